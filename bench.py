@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# bench.py — throughput/latency benchmark against a local fragment.com stand-in
+#
+#   python bench.py run                                  # 100 / 1k / 10k numbers, default profile
+#   python bench.py run --sizes 1000 --latency lognormal:0.15:0.6 --throttle 0.05
+#   python bench.py run --save-baseline bench_baseline.json
+#   python bench.py run --baseline bench_baseline.json   # exit 1 on regression
+#   python bench.py serve --port 8099                    # stand-in only (for check_cli --base-url)
+#   python bench.py format --sizes 4000,40000            # reply post-processing, old vs new
+#
+# The stand-in serves /phone/{num} with configurable latency distribution,
+# restricted/free ratio, 5xx and 429 rates and page size. The harness drives
+# the real FragmentChecker batch path (cache, limiter, retries, classifier)
+# and reports numbers/s, p50/p95/p99 request latency (from slot grant, so limiter
+# queueing is reported separately as queue_p95_ms), peak memory and unknown rate.
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tracemalloc
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+import fragment_client
+import reply_format
+
+logger = logging.getLogger("bench")
+
+# ─── Stand-in server ───────────────────────────────────────────────────────────
+def parse_latency(spec: str) -> Callable[[], float]:
+    """fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA | exp:MEAN  (seconds)"""
+    kind, *vals = spec.split(":")
+    p = [float(v) for v in vals]
+    if kind == "fixed":
+        return lambda: p[0]
+    if kind == "uniform":
+        return lambda: random.uniform(p[0], p[1])
+    if kind == "lognormal":
+        mu = math.log(p[0])
+        return lambda: random.lognormvariate(mu, p[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / p[0])
+    raise ValueError(f"unknown latency spec: {spec}")
+
+def is_restricted_num(num: str, ratio: float) -> bool:
+    """Deterministic per number, so the harness can verify verdicts."""
+    return zlib.crc32(num.encode()) % 10_000 < ratio * 10_000
+
+def _page(num: str, restricted: bool, size: int, marker_at: float) -> bytes:
+    marker = "<div class='status'>This phone number is restricted on Telegram</div>" if restricted else ""
+    head = f"<html><head><title>+{num}</title></head><body><h1>+{num}</h1>"
+    tail = "</body></html>"
+    filler_len = max(0, size - len(head) - len(marker) - len(tail))
+    filler = ("<p>lorem ipsum dolor sit amet consectetur</p>" * (filler_len // 44 + 1))[:filler_len]
+    cut = int(len(filler) * marker_at)
+    return (head + filler[:cut] + marker + filler[cut:] + tail).encode()
+
+def standin_app(cfg: Dict) -> web.Application:
+    latency = parse_latency(cfg["latency"])
+
+    async def phone(request: web.Request) -> web.StreamResponse:
+        num = request.match_info["num"]
+        await asyncio.sleep(latency())
+        r = random.random()
+        if r < cfg["errors"]:
+            return web.Response(status=502, text="bad gateway")
+        if r < cfg["errors"] + cfg["throttle"]:
+            return web.Response(status=429, text="too many requests")
+        restricted = is_restricted_num(num, cfg["restricted"])
+        body = _page(num, restricted, cfg["page_bytes"], cfg["marker_at"])
+        return web.Response(body=body, content_type="text/html", charset="utf-8")
+
+    async def health(_: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/phone/{num}", phone)
+    app.router.add_get("/health", health)
+    return app
+
+def _serve(cfg: Dict, port: int, ready=None) -> None:
+    async def main():
+        runner = web.AppRunner(standin_app(cfg), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port, backlog=4096).start()
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# ─── Harness ───────────────────────────────────────────────────────────────────
+class _TimedLimiter(fragment_client.AdaptiveLimiter):
+    """
+    Records every HTTP attempt (including retries and hedges) twice: the wait
+    for a slot, and the request itself from slot grant to release.
+    """
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.latencies: List[float] = []
+        self.waits: List[float] = []
+
+    async def acquire(self) -> None:
+        t0 = time.perf_counter()
+        await super().acquire()
+        self.waits.append(time.perf_counter() - t0)
+
+    def release(self, latency: float, outcome: Optional[str]) -> None:
+        self.latencies.append(latency)
+        super().release(latency, outcome)
+
+def _pct(data: List[float], q: float) -> float:
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(q * len(data)))]
+
+async def _reset_client() -> None:
+    """Every run starts cold: no cached verdicts, fresh limiter, new pool."""
+    await fragment_client.close_session()
+    fragment_client.status_cache.clear()
+    fragment_client.inflight = fragment_client.SingleFlight()
+    fragment_client.limiter = _TimedLimiter()
+
+async def bench_once(base_url: str, n: int, cfg: Dict, trace_memory: bool) -> Dict:
+    await _reset_client()
+    nums = [str(88800000000 + i) for i in random.sample(range(10**8), n)]
+    checker = fragment_client.FragmentChecker(base_url=base_url)
+    timed = fragment_client.limiter
+
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    results = [r async for r in checker.check_many(nums)]
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    unknown = sum(1 for _, ok in results if ok is None)
+    wrong = sum(
+        1 for num, ok in results if ok is not None and ok != is_restricted_num(num, cfg["restricted"])
+    )
+    return {
+        "numbers": len(results),
+        "seconds": round(elapsed, 3),
+        "numbers_per_sec": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_pct(timed.latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_pct(timed.latencies, 0.95) * 1000, 1),
+        "p99_ms": round(_pct(timed.latencies, 0.99) * 1000, 1),
+        "queue_p95_ms": round(_pct(timed.waits, 0.95) * 1000, 1),
+        "attempts": len(timed.latencies),
+        "unknown_rate": round(unknown / len(results), 4) if results else 0.0,
+        "misclassified": wrong,
+        "peak_traced_kb": round(peak / 1024, 1) if peak is not None else None,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "final_limit": fragment_client.limiter.stats()["limit"],
+    }
+
+def _print_table(rows: List[Dict]) -> None:
+    cols = ["numbers", "numbers_per_sec", "p50_ms", "p95_ms", "p99_ms", "queue_p95_ms", "unknown_rate",
+            "misclassified", "peak_traced_kb", "max_rss_kb", "final_limit"]
+    print("  ".join(f"{c:>15}" for c in cols))
+    for r in rows:
+        print("  ".join(f"{str(r[c]):>15}" for c in cols))
+
+def compare(rows: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Regressions: throughput down or p95 / unknown rate up by more than tolerance."""
+    problems = []
+    base = {b["numbers"]: b for b in baseline}
+    for r in rows:
+        b = base.get(r["numbers"])
+        if not b:
+            continue
+        if r["numbers_per_sec"] < b["numbers_per_sec"] * (1 - tolerance):
+            problems.append(f"{r['numbers']}: throughput {r['numbers_per_sec']}/s vs {b['numbers_per_sec']}/s")
+        if r["p95_ms"] > b["p95_ms"] * (1 + tolerance) + 5:
+            problems.append(f"{r['numbers']}: p95 {r['p95_ms']}ms vs {b['p95_ms']}ms")
+        if r["unknown_rate"] > b["unknown_rate"] + tolerance * 0.1:
+            problems.append(f"{r['numbers']}: unknown rate {r['unknown_rate']} vs {b['unknown_rate']}")
+        if r["misclassified"]:
+            problems.append(f"{r['numbers']}: {r['misclassified']} misclassified")
+    return problems
+
+def _cfg(args: argparse.Namespace) -> Dict:
+    return {
+        "latency": args.latency,
+        "restricted": args.restricted,
+        "errors": args.errors,
+        "throttle": args.throttle,
+        "page_bytes": int(args.page_kb * 1024),
+        "marker_at": args.marker_at,
+    }
+
+def cmd_run(args: argparse.Namespace) -> int:
+    cfg = _cfg(args)
+    port = _free_port()
+    ready = multiprocessing.get_context("fork").Event()
+    server = multiprocessing.get_context("fork").Process(target=_serve, args=(cfg, port, ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(10):
+            print("stand-in server did not start", file=sys.stderr)
+            return 2
+        base_url = f"http://127.0.0.1:{port}"
+        sizes = [int(s) for s in args.sizes.split(",") if s]
+
+        async def run_all() -> List[Dict]:
+            out = []
+            for n in sizes:
+                out.append(await bench_once(base_url, n, cfg, args.tracemalloc))
+                logger.info(f"{n} numbers done")
+            await fragment_client.close_session()
+            return out
+
+        rows = asyncio.run(run_all())
+    finally:
+        server.terminate()
+        server.join(5)
+
+    _print_table(rows)
+    report = {"config": cfg, "results": rows}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(rows, json.load(f)["results"], args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    print(f"stand-in listening on http://127.0.0.1:{args.port}", file=sys.stderr)
+    _serve(_cfg(args), args.port)
+    return 0
+
+# ─── Reply formatting micro-benchmark ──────────────────────────────────────────
+def _legacy_is_emoji(ch: str) -> bool:
+    cp = ord(ch)
+    return (
+        0x1F300 <= cp <= 0x1F5FF or 0x1F600 <= cp <= 0x1F64F or 0x1F680 <= cp <= 0x1F6FF or
+        0x1F700 <= cp <= 0x1F77F or 0x1F780 <= cp <= 0x1F7FF or 0x1F800 <= cp <= 0x1F8FF or
+        0x1F900 <= cp <= 0x1F9FF or 0x1FA00 <= cp <= 0x1FAFF or 0x2600 <= cp <= 0x26FF or
+        0x2700 <= cp <= 0x27BF or 0xFE00 <= cp <= 0xFE0F or 0x1F1E6 <= cp <= 0x1F1FF or
+        cp == 0x20E3
+    )
+
+def _legacy_format(text: str, allow_emojis: bool) -> str:
+    """The per-character implementation bot.py used before reply_format, kept as the baseline."""
+    out_lines = []
+    for ln in (text or "").splitlines():
+        s = ln.strip()
+        if s.startswith("##"):
+            s = "• " + s.lstrip("#").strip()
+        elif s.startswith("* ") or s.startswith("- "):
+            s = "• " + s[2:].strip()
+        out_lines.append(s)
+    normalized = "\n".join(out_lines).strip()
+    if not allow_emojis:
+        return "".join(ch for ch in normalized if not _legacy_is_emoji(ch)).strip()
+    count = 0
+    kept = []
+    for ch in normalized:
+        if _legacy_is_emoji(ch):
+            count += 1
+            if count <= 2:
+                kept.append(ch)
+        else:
+            kept.append(ch)
+    return "".join(kept).strip()
+
+def _sample_reply(size: int, seed: int = 1) -> str:
+    rnd = random.Random(seed)
+    words = ["latency", "fragment", "number", "<b>", "&", "restricted", "the", "a", "check", "queue"]
+    emojis = ["🚀", "✅", "⚠️", "📶", "🙂"]
+    lines = []
+    total = 0
+    while total < size:
+        kind = rnd.random()
+        body = " ".join(rnd.choice(words) for _ in range(rnd.randint(4, 16)))
+        if rnd.random() < 0.2:
+            body += " " + rnd.choice(emojis)
+        if kind < 0.1:
+            ln = f"## {body}"
+        elif kind < 0.4:
+            ln = f"  {rnd.choice('*-')} {body}  "
+        else:
+            ln = body
+        lines.append(ln)
+        total += len(ln) + 1
+    return "\n".join(lines)
+
+def _best_of(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def cmd_format(args: argparse.Namespace) -> int:
+    print(f"{'chars':>9} {'emojis':>7} {'legacy_ms':>10} {'new_ms':>8} {'speedup':>8} {'split_ms':>9} {'chunks':>7}")
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        text = _sample_reply(size)
+        for allow in (True, False):
+            old = _legacy_format(text, allow)
+            new = reply_format.format_reply(text, allow, 2)
+            if old != new:
+                print(f"MISMATCH at {size} chars (allow_emojis={allow})", file=sys.stderr)
+                return 1
+            t_old = _best_of(lambda: _legacy_format(text, allow), args.repeat)
+            t_new = _best_of(lambda: reply_format.format_reply(text, allow, 2), args.repeat)
+            t_split = _best_of(lambda: reply_format.split_html(new), args.repeat)
+            chunks = reply_format.split_html(new)
+            if any(len(c) > reply_format.TELEGRAM_LIMIT for c in chunks):
+                print(f"oversized chunk at {size} chars", file=sys.stderr)
+                return 1
+            print(
+                f"{len(text):>9} {'cap 2' if allow else 'strip':>7} {t_old * 1000:>10.2f} {t_new * 1000:>8.2f} "
+                f"{t_old / t_new:>7.1f}x {t_split * 1000:>9.2f} {len(chunks):>7}"
+            )
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark fragment checks against a local stand-in.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    def server_opts(sp: argparse.ArgumentParser) -> None:
+        sp.add_argument("--latency", default="lognormal:0.08:0.5", help="fixed:S | uniform:LO:HI | lognormal:MED:SIGMA | exp:MEAN")
+        sp.add_argument("--restricted", type=float, default=0.1, help="fraction of restricted numbers")
+        sp.add_argument("--errors", type=float, default=0.01, help="fraction of 502 responses")
+        sp.add_argument("--throttle", type=float, default=0.01, help="fraction of 429 responses")
+        sp.add_argument("--page-kb", type=float, default=40, help="page size in KiB")
+        sp.add_argument("--marker-at", type=float, default=0.3, help="where the marker sits in the page (0..1)")
+
+    run = sub.add_parser("run", help="start a stand-in and benchmark against it")
+    server_opts(run)
+    run.add_argument("--sizes", default="100,1000,10000")
+    run.add_argument("--out", default="", help="write the JSON report here")
+    run.add_argument("--baseline", default="", help="compare against this report, exit 1 on regression")
+    run.add_argument("--save-baseline", default="", help="store this run as the new baseline")
+    run.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    run.add_argument("--tracemalloc", action="store_true", help="trace Python allocations for peak memory (slower)")
+    run.set_defaults(func=cmd_run)
+
+    serve = sub.add_parser("serve", help="only run the stand-in server")
+    server_opts(serve)
+    serve.add_argument("--port", type=int, default=8099)
+    serve.set_defaults(func=cmd_serve)
+
+    fmt = sub.add_parser("format", help="micro-benchmark reply post-processing against the old implementation")
+    fmt.add_argument("--sizes", default="1000,4000,40000,400000", help="reply sizes in characters")
+    fmt.add_argument("--repeat", type=int, default=20, help="runs per measurement (best is reported)")
+    fmt.set_defaults(func=cmd_format)
+    return p
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", stream=sys.stderr)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
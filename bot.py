@@ -2,14 +2,14 @@
 import os
 import sys
 import html
-import json
 import logging
 import asyncio
 import re
-from typing import Dict, List, Tuple, Optional  # ← added Tuple, Optional
+import random
+from typing import Optional
 
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command
@@ -17,8 +17,10 @@ from aiogram.types import Message, InlineQuery, InlineQueryResultArticle, InputT
 
 from SafoneAPI import SafoneAPI
 
-# ─── ChatGPT toggle state (DMs) ────────────────────────────────────
-chatgpt_enabled: Dict[int, bool] = {}
+import chat_memory
+import metrics
+import reply_format
+from chat_queue import Busy, chat_queue
 
 # ─── LOAD ENV & CONFIG ────────────────────────────────────────────
 load_dotenv()
@@ -29,10 +31,32 @@ if not BOT_TOKEN:
 SCREEN_SESSION = os.getenv("SCREEN_SESSION", "meow")   # kept for compatibility with other plugins
 ADMIN_CHAT_ID  = int(os.getenv("ADMIN_CHAT_ID", "0"))
 PROJECT_PATH   = os.getenv("PROJECT_PATH", os.getcwd())
+METRICS_PORT   = int(os.getenv("METRICS_PORT", "0"))      # >0 → Prometheus text on 127.0.0.1:PORT/metrics
+
+# Webhook mode (polling unless WEBHOOK_URL is set). Single replica only: saved numbers,
+# the status cache, /cancel flags and chat memory all live in this process.
+WEBHOOK_URL    = os.getenv("WEBHOOK_URL", "").rstrip("/")  # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH   = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")           # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST   = os.getenv("WEBHOOK_HOST", "127.0.0.1")    # behind a local reverse proxy by default
+WEBHOOK_PORT   = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SET    = os.getenv("WEBHOOK_SET", "1") == "1"      # 0 for local tests posting captured updates: don't call setWebhook
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "15"))  # seconds to finish in-flight updates
+WEBHOOK_READY_GRACE   = float(os.getenv("WEBHOOK_READY_GRACE", "5"))     # /readyz is 503 this long before the port closes
 
 # Memory settings
-MEMORY_FILE = os.getenv("MEMORY_FILE", "memory.json")
+MEMORY_FILE = os.getenv("MEMORY_FILE", "memory.json")   # legacy, imported once into MEMORY_DB
+MEMORY_DB   = os.getenv("MEMORY_DB", "memory.db")
 MAX_MEMORY  = int(os.getenv("MAX_MEMORY", "20"))  # messages kept per chat
+MEMORY_RESIDENT_MAX   = int(os.getenv("MEMORY_RESIDENT_MAX", "500"))    # chats kept in RAM, LRU beyond that
+MEMORY_CONTEXT_CHARS  = int(os.getenv("MEMORY_CONTEXT_CHARS", "4000"))  # prompt history budget (~4 chars/token)
+MEMORY_LINE_CHARS     = int(os.getenv("MEMORY_LINE_CHARS", "600"))      # longer messages are condensed
+GROUP_CONTEXT_SAMPLE  = float(os.getenv("GROUP_CONTEXT_SAMPLE", "1.0")) # share of unaddressed group lines remembered
+GROUP_CONTEXT_MAX_LEN = int(os.getenv("GROUP_CONTEXT_MAX_LEN", "200"))  # longer unaddressed lines are skipped
+GROUP_CONTEXT_KEEP    = int(os.getenv("GROUP_CONTEXT_KEEP", "5"))       # unaddressed lines kept per chat
+REPLY_MAX_EMOJIS      = int(os.getenv("REPLY_MAX_EMOJIS", "2"))         # emojis kept in a reply when allowed
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "5"))  # seconds between writes
+MEMORY_FLUSH_DIRTY    = int(os.getenv("MEMORY_FLUSH_DIRTY", "50"))      # or sooner after this many changes
 
 # ─── LOGGING ──────────────────────────────────────────────────────
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -42,17 +66,59 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 
+# ─── METRICS ──────────────────────────────────────────────────────
+HANDLER_SECONDS = metrics.histogram("handler_seconds", "Telegram handler latency")
+HANDLER_ERRORS  = metrics.counter("handler_errors_total", "Exceptions escaping handlers")
+MEMORY_FLUSH_SECONDS = metrics.histogram("memory_flush_seconds", "Time to persist chat memory")
+CHATGPT_SECONDS = metrics.histogram("chatgpt_seconds", "SafoneAPI chatgpt call latency")
+CHATGPT_ERRORS  = metrics.counter("chatgpt_errors_total", "SafoneAPI chatgpt failures by error class")
+
+class _HandlerMetrics(BaseMiddleware):
+    """Inner middleware: time every matched handler, labelled by its function name."""
+
+    async def __call__(self, handler, event, data):
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        with HANDLER_SECONDS.time(handler=name):
+            try:
+                return await handler(event, data)
+            except Exception as e:
+                HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+                raise
+
+dp.message.middleware(_HandlerMetrics())
+dp.inline_query.middleware(_HandlerMetrics())
+
 # ─── SAFONEAPI CLIENT ─────────────────────────────────────────────
 api = SafoneAPI()
 
+async def _ask_chatgpt(prompt: str):
+    with CHATGPT_SECONDS.time():
+        try:
+            return await api.chatgpt(prompt)
+        except Exception as e:
+            CHATGPT_ERRORS.inc(error=type(e).__name__)
+            raise
+
+metrics.register_gauges("chat_queue", chat_queue.stats)
+metrics.register_gauges("chat_memory", lambda: _memory.stats() if _memory is not None else {})
+
+BUSY_REPLY = "⏳ I'm handling too many chats right now, please try again in a moment."
+
+def is_admin(message: Message) -> bool:
+    """ADMIN_CHAT_ID is the chat or the sender; shared with plugins (/stats, /profile)."""
+    return bool(ADMIN_CHAT_ID) and ADMIN_CHAT_ID in (message.chat.id, message.from_user.id)
+
 # ─── PLUGINS (unchanged) ──────────────────────────────────────────
 import fragment_url   # inline 888 → fragment.com URL
 import speed          # /speed VPS speedtest
 import fragment       # /save, /list, /checkall, inline /check handlers
+import profiler       # /profile on-demand profiling, event-loop lag watchdog
 
 # ─── SIMPLE PERSISTENT MEMORY (per chat) ──────────────────────────
-_memory: Dict[str, List[dict]] = {}   # key: str(chat_id)
-_emoji_pref: Dict[int, bool] = {}     # True=allow sparse emojis, False=strip all
+# History, emoji preference and /act state per chat live in chat_memory:
+# at most MEMORY_RESIDENT_MAX chats in RAM, the rest in MEMORY_DB.
+_memory: Optional[chat_memory.ChatMemory] = None
 
 NO_EMOJI_PATTERNS = [
     r"\bno\s*emoji(?:s)?\b",
@@ -69,49 +135,79 @@ YES_EMOJI_PATTERNS = [
 
 def _load_memory():
     global _memory
-    try:
-        with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-            _memory = json.load(f)
-    except Exception:
-        _memory = {}
+    _memory = chat_memory.open_memory(
+        MEMORY_DB, MAX_MEMORY, MEMORY_RESIDENT_MAX, legacy_json=MEMORY_FILE, on_change=_mark_dirty,
+        context_chars=MEMORY_CONTEXT_CHARS, line_chars=MEMORY_LINE_CHARS,
+    )
 
 def _save_memory():
+    """Synchronous flush (used on shutdown)."""
     try:
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(_memory, f, ensure_ascii=False, indent=2)
+        with MEMORY_FLUSH_SECONDS.time(mode="sync"):
+            _memory.flush_sync()
     except Exception as e:
         logger.error(f"Failed saving memory: {e}")
 
+# ─── Write-behind persistence ─────────────────────────────────────
+_dirty_changes = 0
+_flush_wakeup: Optional[asyncio.Event] = None
+_flush_task: Optional[asyncio.Task] = None
+
+def _mark_dirty():
+    global _dirty_changes
+    _dirty_changes += 1
+    if _flush_wakeup is not None and _dirty_changes >= MEMORY_FLUSH_DIRTY:
+        _flush_wakeup.set()
+
+async def _flush_memory():
+    global _dirty_changes
+    if not _memory.pending:
+        return
+    _dirty_changes = 0
+    try:
+        with MEMORY_FLUSH_SECONDS.time(mode="background"):
+            await _memory.flush()
+    except Exception as e:
+        logger.error(f"Failed saving memory: {e}")  # rows stay pending, retried next round
+
+async def _memory_flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), MEMORY_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        await _flush_memory()
+
 def _append_memory(chat_id: int, role: str, content: str):
-    key = str(chat_id)
-    _memory.setdefault(key, [])
-    _memory[key].append({"role": role, "content": (content or "").strip()})
-    if len(_memory[key]) > MAX_MEMORY:
-        _memory[key] = _memory[key][-MAX_MEMORY:]
-    _save_memory()
+    _memory.append(chat_id, role, content)
+
+def _append_group_context(chat_id: int, text: str):
+    """Sampling policy for group lines not addressed to the bot."""
+    if not text or len(text) > GROUP_CONTEXT_MAX_LEN or GROUP_CONTEXT_KEEP <= 0:
+        return
+    if GROUP_CONTEXT_SAMPLE < 1.0 and random.random() >= GROUP_CONTEXT_SAMPLE:
+        return
+    _memory.append_context(chat_id, text, GROUP_CONTEXT_KEEP)
 
 def _update_emoji_pref(chat_id: int, user_text: str):
     text = (user_text or "").lower()
     for p in NO_EMOJI_PATTERNS:
         if re.search(p, text):
-            _emoji_pref[chat_id] = False
+            _memory.set_emoji(chat_id, False)
             return
     for p in YES_EMOJI_PATTERNS:
         if re.search(p, text):
-            _emoji_pref[chat_id] = True
+            _memory.set_emoji(chat_id, True)
             return
     # if no explicit instruction, leave existing preference as-is (default True)
 
 def _build_context(chat_id: int, user_text: str) -> str:
-    """Build a single prompt string with short context so SafoneAPI can 'remember'."""
-    msgs = _memory.get(str(chat_id), [])[-(MAX_MEMORY - 1):]
-    ctx_lines: List[str] = []
-    for m in msgs:
-        r = m.get("role", "user")
-        c = (m.get("content", "") or "").replace("\n", " ").strip()
-        if c:
-            ctx_lines.append(f"{r.title()}: {c}")
-    ctx = "\n".join(ctx_lines)
+    """
+    Build a single prompt string with short context so SafoneAPI can 'remember'.
+    Call before appending user_text; the history is pre-rendered and budgeted in chat_memory.
+    """
+    ctx = _memory.context(chat_id)
 
     guidelines = (
         "Guidelines: Be concise and helpful. Use emojis sparingly only if they add clarity. "
@@ -123,78 +219,56 @@ def _build_context(chat_id: int, user_text: str) -> str:
     prompt = f"{prefix}User: {user_text}\n\n{guidelines}"
     return prompt
 
-# ─── Emoji utilities (limit or strip) ─────────────────────────────
-def _is_emoji(ch: str) -> bool:
-    cp = ord(ch)
-    return (
-        0x1F300 <= cp <= 0x1F5FF or   # symbols & pictographs
-        0x1F600 <= cp <= 0x1F64F or   # emoticons
-        0x1F680 <= cp <= 0x1F6FF or   # transport & map
-        0x1F700 <= cp <= 0x1F77F or
-        0x1F780 <= cp <= 0x1F7FF or
-        0x1F800 <= cp <= 0x1F8FF or
-        0x1F900 <= cp <= 0x1F9FF or   # supplemental symbols & pictographs
-        0x1FA00 <= cp <= 0x1FAFF or
-        0x2600  <= cp <= 0x26FF  or   # misc symbols
-        0x2700  <= cp <= 0x27BF  or   # dingbats
-        0xFE00  <= cp <= 0xFE0F  or   # variation selectors
-        0x1F1E6 <= cp <= 0x1F1FF or   # flags
-        cp == 0x20E3                  # keycap
-    )
-
-def _format_response(text: str, allow_emojis: bool) -> str:
-    text = text or ""
-    # Normalize headings & bullets (no emoji bullets)
-    lines = text.splitlines()
-    out_lines: List[str] = []
-    for ln in lines:
-        s = ln.strip()
-        if s.startswith("##"):
-            s = "• " + s.lstrip("#").strip()
-        elif s.startswith("* ") or s.startswith("- "):
-            s = "• " + s[2:].strip()
-        out_lines.append(s)
-    normalized = "\n".join(out_lines).strip()
-
-    if not allow_emojis:
-        # strip all emojis
-        return "".join(ch for ch in normalized if not _is_emoji(ch)).strip()
-
-    # allow at most 2 emojis total
-    count = 0
-    kept_chars: List[str] = []
-    for ch in normalized:
-        if _is_emoji(ch):
-            count += 1
-            if count <= 2:
-                kept_chars.append(ch)
-            # else: skip extra emojis
-        else:
-            kept_chars.append(ch)
-    return "".join(kept_chars).strip()
-
 # ─── /act & /actnot Commands (DMs) ────────────────────────────────
 @dp.message(Command("act"))
 async def activate_chatgpt(message: Message):
     if message.chat.type != "private":
         return await message.reply("🤖 /act only works in a private chat.")
-    chatgpt_enabled[message.from_user.id] = True
+    _memory.set_enabled(message.from_user.id, True)
     await message.reply("ChatGPT fallback is now ON for your DMs.")
 
 @dp.message(Command("actnot"))
 async def deactivate_chatgpt(message: Message):
     if message.chat.type != "private":
         return await message.reply("🤖 /actnot only works in a private chat.")
-    chatgpt_enabled[message.from_user.id] = False
+    _memory.set_enabled(message.from_user.id, False)
     await message.reply("ChatGPT fallback is now OFF for your DMs.")
 
+# ─── /stats (admin only) ──────────────────────────────────────────
+@dp.message(Command("stats"))
+async def stats_handler(message: Message):
+    if not is_admin(message):
+        return
+    lines = metrics.summary() or ["(no data yet)"]
+    body = html.escape("\n".join(lines))
+    if len(body) > 3800:
+        body = body[:3800] + "\n…(truncated, see the /metrics endpoint)"
+    await message.reply(f"📈 <b>Stats</b>\n<pre>{body}</pre>", parse_mode="HTML")
+
+# ─── Chat reply pipeline (runs inside chat_queue, one per chat at a time) ──────
+async def _chat_reply(message: Message, text: str, quote: bool) -> None:
+    _update_emoji_pref(message.chat.id, text)
+    prompt = _build_context(message.chat.id, text)
+    _append_memory(message.chat.id, "user", text)
+    resp   = await _ask_chatgpt(prompt)
+    answer = getattr(resp, "message", None) or str(resp)
+    allow  = _memory.emoji_allowed(message.chat.id)
+    answer = reply_format.format_reply(answer, allow, REPLY_MAX_EMOJIS)
+    _append_memory(message.chat.id, "assistant", answer)
+    # long answers go out as several messages instead of failing at 4096 chars
+    for i, chunk in enumerate(reply_format.split_html(answer) or ["…"]):
+        if quote and i == 0:
+            await message.reply(chunk)
+        else:
+            await message.answer(chunk)
+
 # ─── ChatGPT Fallback (DMs) with memory + emoji rules ─────────────
 @dp.message(F.text & ~F.text.startswith("/"))
 async def chatgpt_handler(message: Message):
     # only in private when /act has been used
     if message.chat.type != "private":
         return
-    if not chatgpt_enabled.get(message.from_user.id, False):
+    if not _memory.is_enabled(message.from_user.id):
         return
 
     text = (message.text or "").strip()
@@ -202,15 +276,12 @@ async def chatgpt_handler(message: Message):
         return
 
     try:
-        _update_emoji_pref(message.chat.id, text)
-        _append_memory(message.chat.id, "user", text)
-        prompt = _build_context(message.chat.id, text)
-        resp   = await api.chatgpt(prompt)
-        answer = getattr(resp, "message", None) or str(resp)
-        allow  = _emoji_pref.get(message.chat.id, True)
-        answer = _format_response(answer, allow)
-        _append_memory(message.chat.id, "assistant", answer)
-        await message.answer(html.escape(answer))
+        await chat_queue.run(message.chat.id, lambda: _chat_reply(message, text, quote=False))
+    except Busy:
+        await message.reply(BUSY_REPLY)
+    except asyncio.TimeoutError:
+        logger.warning(f"chatgpt reply for {message.chat.id} missed its deadline")
+        await message.reply("SafoneAPI failed or no response.")
     except Exception:
         logger.exception("chatgpt error")
         await message.reply("SafoneAPI failed or no response.")
@@ -218,6 +289,7 @@ async def chatgpt_handler(message: Message):
 # ─── Group/Supergroup handler ─────────────────────────────────────
 BOT_USERNAME = None
 BOT_ID = None
+_metrics_runner = None
 
 def _is_addressed_to_bot(msg: Message) -> bool:
     try:
@@ -246,10 +318,8 @@ def _strip_bot_mention(text: str) -> str:
 @dp.message(F.text & ((F.chat.type == "group") | (F.chat.type == "supergroup")))
 async def group_chatgpt_handler(message: Message):
     txt = (message.text or "").strip()
-    if txt and len(txt) <= 200:
-        _append_memory(message.chat.id, "user", f"[group context] {txt}")
-
     if not _is_addressed_to_bot(message):
+        _append_group_context(message.chat.id, txt)
         return
 
     text = _strip_bot_mention(txt)
@@ -257,15 +327,12 @@ async def group_chatgpt_handler(message: Message):
         return
 
     try:
-        _update_emoji_pref(message.chat.id, text)
-        _append_memory(message.chat.id, "user", text)
-        prompt = _build_context(message.chat.id, text)
-        resp   = await api.chatgpt(prompt)
-        answer = getattr(resp, "message", None) or str(resp)
-        allow  = _emoji_pref.get(message.chat.id, True)
-        answer = _format_response(answer, allow)
-        _append_memory(message.chat.id, "assistant", answer)
-        await message.reply(html.escape(answer))
+        await chat_queue.run(message.chat.id, lambda: _chat_reply(message, text, quote=True))
+    except Busy:
+        await message.reply(BUSY_REPLY)
+    except asyncio.TimeoutError:
+        logger.warning(f"group chatgpt reply for {message.chat.id} missed its deadline")
+        await message.reply("Couldn't get a reply right now.")
     except Exception as e:
         logger.exception(f"group chatgpt error: {e}")
         await message.reply("Couldn't get a reply right now.")
@@ -273,61 +340,16 @@ async def group_chatgpt_handler(message: Message):
 # ─── INLINE: Restricted-only scan (no collision with other inline) ────────────
 # Triggers: query starts with "chk", "res", or "restricted" (case-insensitive)
 # Usage: @YourBotName chk
-import aiohttp
-
-_DEFAULT_HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/115.0.0.0 Safari/537.36"
-    ),
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    "Accept-Language": "en-US,en;q=0.9",
-}
-
-_RESTRICT_PATTERNS = [
-    re.compile(r"\brestricted on Telegram\b", re.I),
-    re.compile(r"\bThis phone number is restricted\b", re.I),
-    re.compile(r"\bBlocked\b", re.I),
-]
-
-def _canonical_num(tok: str) -> str:
-    return re.sub(r"\D", "", (tok or ""))
-
-def _is_restricted_html(html_text: str) -> Optional[bool]:
-    if not html_text:
-        return None
-    for p in _RESTRICT_PATTERNS:
-        if p.search(html_text):
-            return True
-    return False  # reachable page without matches → not restricted
-
-async def _fetch_status_inline(
-    session: aiohttp.ClientSession,
-    num: str,
-    sem: asyncio.Semaphore,
-    timeout_total: float,
-) -> Tuple[str, Optional[bool]]:
-    url = f"https://fragment.com/phone/{num}"
-    try:
-        async with sem:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout_total)) as resp:
-                txt = await resp.text(errors="ignore")
-                return num, _is_restricted_html(txt)
-    except Exception as e:
-        logger.warning(f"[inline] fetch failed for {num}: {e!r}")
-        return num, None
-
 INLINE_TRIGGERS = {"chk", "res", "restricted"}
 
 @dp.inline_query(F.query.func(lambda q: bool(q) and (q.strip().split()[0].lower() in INLINE_TRIGGERS)))
 async def inline_restricted_scan(inline_q: InlineQuery):
     """
-    Scans saved numbers (fragment._saves) and returns ONLY restricted ones.
+    Scans saved numbers (fragment.saved_numbers) and returns ONLY restricted ones.
     Filtered by first token in query, so other inline handlers (e.g., fragment_url) won't collide.
     """
     uid = inline_q.from_user.id
-    nums = fragment._saves.get(uid, []) if hasattr(fragment, "_saves") else []
+    nums = fragment.saved_numbers(uid)
 
     if not nums:
         article = InlineQueryResultArticle(
@@ -340,60 +362,125 @@ async def inline_restricted_scan(inline_q: InlineQuery):
         )
         return await inline_q.answer([article], cache_time=0, is_personal=True)
 
-    # normalize, dedupe, sort
-    norm = sorted(set(_canonical_num(n) for n in nums if _canonical_num(n)))
-
-    # Inline should be fast
-    concurrency = min(len(norm), 50)
-    sem = asyncio.Semaphore(concurrency)
-    timeout_total = 5.0
-    conn = aiohttp.TCPConnector(limit_per_host=concurrency, ssl=False)
-
-    async with aiohttp.ClientSession(connector=conn, headers=_DEFAULT_HEADERS) as sess:
-        results = await asyncio.gather(
-            *(_fetch_status_inline(sess, n, sem, timeout_total) for n in norm),
-            return_exceptions=False,
-        )
-
-    restricted = [n for n, ok in results if ok is True]
-    unknown    = [n for n, ok in results if ok is None]
-
-    if restricted:
-        # keep body under inline message limits
-        body = "\n".join(
-            f"🔒 <a href='https://fragment.com/phone/{n}'>{n}</a>"
-            for n in restricted[:400]
-        )
-    else:
-        body = "✅ No restricted numbers found."
-
-    if unknown:
-        body += "\n\n⚠️ Could not verify (sample):\n" + "\n".join(unknown[:20])
-        if len(unknown) > 20:
-            body += f"\n…(+{len(unknown) - 20} more)"
-
-    title = f"🔍 Restricted: {len(restricted)} | ⚠️ Unknown: {len(unknown)}"
-
-    article = InlineQueryResultArticle(
-        id="restricted_only",
-        title=title,
-        input_message_content=InputTextMessageContent(body, parse_mode="HTML"),
-        description="Show only restricted numbers (and unknown if any)",
-    )
-    # cache_time=0 + is_personal → fresh, per-user
-    await inline_q.answer([article], cache_time=0, is_personal=True)
+    # Inline must answer fast: serve the cached snapshot, refresh in the background
+    snap = await fragment.inline_snapshot(uid, nums)
+    # cache_time=0 + is_personal → per-user, and the next query sees refreshed results
+    await inline_q.answer([fragment.inline_article(snap)], cache_time=0, is_personal=True)
 
 # ─── STARTUP ───────────────────────────────────────────────────────
 @dp.startup()
 async def on_startup():
     global BOT_USERNAME, BOT_ID
+    global _flush_wakeup, _flush_task, _metrics_runner
     _load_memory()
+    _flush_wakeup = asyncio.Event()
+    _flush_task = asyncio.create_task(_memory_flusher())
+    chat_queue.start()
     me = await bot.get_me()
     BOT_USERNAME = (me.username or "").strip()
     BOT_ID = me.id
-    logger.info(f"@{BOT_USERNAME} (id={BOT_ID}) is up. Memory file: {MEMORY_FILE}")
+    logger.info(f"@{BOT_USERNAME} (id={BOT_ID}) is up. Memory db: {MEMORY_DB}")
+    if METRICS_PORT:
+        _metrics_runner = await metrics.start_http(METRICS_PORT)
+
+@dp.shutdown()
+async def on_shutdown():
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+    await chat_queue.stop()
+    if _flush_task is not None:
+        _flush_task.cancel()
+    _save_memory()  # final flush so nothing marked dirty is lost
+    _memory.close()
+
+# ─── WEBHOOK MODE ──────────────────────────────────────────────────
+_inflight_updates = 0
+_ready = False       # /readyz: startup finished and not draining
+
+class _InflightUpdates(BaseMiddleware):
+    """Counts updates being processed so shutdown can wait for them."""
+
+    async def __call__(self, handler, event, data):
+        global _inflight_updates
+        _inflight_updates += 1
+        try:
+            return await handler(event, data)
+        finally:
+            _inflight_updates -= 1
+
+dp.update.outer_middleware(_InflightUpdates())
+
+def run_webhook():
+    import signal
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    async def healthz(_: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def readyz(_: web.Request) -> web.Response:
+        return web.Response(text="ready") if _ready else web.Response(status=503, text="not ready")
+
+    async def drain(_: web.Application):
+        """Runs before the dispatcher shuts down: let running updates finish."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WEBHOOK_DRAIN_TIMEOUT
+        while _inflight_updates and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if _inflight_updates:
+            logger.warning(f"shutting down with {_inflight_updates} updates still running")
+
+    async def on_app_startup(_: web.Application):
+        global _ready
+        if WEBHOOK_SET:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True,
+            )
+            logger.info(f"webhook set to {WEBHOOK_URL}{WEBHOOK_PATH}")
+        _ready = True
+
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.on_shutdown.append(drain)  # registered first → runs before the dispatcher's shutdown
+    # updates are acknowledged at once and processed in the background, like polling does
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None, handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    app.on_startup.append(on_app_startup)
+
+    async def serve():
+        # not web.run_app: it closes the listener first on SIGTERM, so /readyz could never say 503
+        global _ready
+        runner = web.AppRunner(app, access_log=None, handle_signals=False, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            logger.info(f"Serving webhook on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, stop.set)
+            await stop.wait()
+            # report not-ready while still accepting updates, so the proxy stops routing here first
+            _ready = False
+            logger.info(f"Shutdown requested; draining in {WEBHOOK_READY_GRACE:g}s")
+            await asyncio.sleep(WEBHOOK_READY_GRACE)
+        finally:
+            await runner.cleanup()  # closes the port, then drain → dispatcher shutdown
+
+    asyncio.run(serve())
 
 # ─── RUN ───────────────────────────────────────────────────────────
 if __name__ == "__main__":
     logger.info("Bot is starting…")
-    dp.run_polling(bot, skip_updates=True, reset_webhook=True)
+    if WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET is not set; anyone who can reach the port can post updates")
+        run_webhook()
+    else:
+        dp.run_polling(bot, skip_updates=True, reset_webhook=True)
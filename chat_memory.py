@@ -0,0 +1,334 @@
+# chat_memory.py — bounded per-chat conversation memory backed by SQLite
+import os
+import json
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[str, str]                       # (role, content); role is user | assistant | context
+Row = Tuple[int, str, Optional[int], int]     # (chat_id, history json, emoji, enabled)
+
+ROLES = {"user": "user", "assistant": "assistant", "context": "context"}  # interned role strings
+
+def render_line(role: str, content: str, max_chars: int) -> str:
+    """One prompt line per stored message; overlong messages are condensed to their head."""
+    c = content.replace("\n", " ")
+    if len(c) > max_chars:
+        c = c[: max_chars - 1].rstrip() + "…"
+    if role == "context":
+        return f"User: [group context] {c}"
+    return f"{role.title()}: {c}"
+
+class ChatState:
+    """
+    One chat: a ring buffer of recent messages plus its two preferences.
+    The rendered prompt lines are kept next to the history and trimmed from
+    the oldest end whenever they exceed the character budget, so appending
+    costs O(new message) and the context never grows past the budget.
+    """
+
+    __slots__ = ("history", "lines", "chars", "budget", "line_chars", "emoji", "enabled", "_ctx")
+
+    def __init__(
+        self,
+        max_messages: int,
+        budget: int,
+        line_chars: int,
+        history=(),
+        emoji: Optional[bool] = None,
+        enabled: bool = False,
+    ):
+        self.history: Deque[Entry] = deque(maxlen=max_messages)
+        self.lines: Deque[str] = deque()
+        self.chars = 0                # len of all lines + separators
+        self.budget = budget
+        self.line_chars = line_chars
+        self.emoji = emoji            # None = never asked → default (allow sparse emojis)
+        self.enabled = enabled        # /act in DMs
+        self._ctx: Optional[str] = None
+        for r, c in history:
+            if c:
+                self.push(ROLES.get(r, "user"), c)
+
+    def push(self, role: str, content: str) -> None:
+        if len(self.history) == self.history.maxlen:
+            self.drop(0)
+        line = render_line(role, content, self.line_chars)
+        self.history.append((role, content))
+        self.lines.append(line)
+        self.chars += len(line) + 1
+        while self.chars > self.budget and len(self.lines) > 1:
+            self.drop(0)
+        self._ctx = None
+
+    def drop(self, i: int) -> None:
+        if i == 0:
+            self.history.popleft()
+            line = self.lines.popleft()
+        else:
+            del self.history[i]
+            line = self.lines[i]
+            del self.lines[i]
+        self.chars -= len(line) + 1
+        self._ctx = None
+
+    def context(self) -> str:
+        if self._ctx is None:
+            self._ctx = "\n".join(self.lines)
+        return self._ctx
+
+    def is_blank(self) -> bool:
+        return not self.history and self.emoji is None and not self.enabled
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_memory (
+    chat_id INTEGER PRIMARY KEY,
+    history TEXT NOT NULL,
+    emoji   INTEGER,
+    enabled INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+class ChatMemory:
+    """
+    Keeps at most resident_max chats in RAM (LRU). Others live only in SQLite
+    and are loaded on first access. Changes are written behind: dirty chats
+    are serialized on flush() or on eviction and written by one background
+    thread, so the loop never waits on disk and only changed chats are rewritten.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_messages: int,
+        resident_max: int,
+        on_change: Optional[Callable[[], None]] = None,
+        context_chars: int = 4000,
+        line_chars: int = 600,
+    ):
+        self.path = path
+        self.max_messages = max_messages
+        self.context_chars = context_chars
+        self.line_chars = line_chars
+        self.resident_max = max(1, resident_max)
+        self.on_change = on_change
+        self._resident: "OrderedDict[int, ChatState]" = OrderedDict()
+        self._dirty: set = set()
+        self._unflushed: Dict[int, Row] = {}   # serialized but not yet confirmed on disk
+        # reads happen on the loop thread, writes on the worker; WAL lets them overlap
+        self._read = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._read.execute("PRAGMA journal_mode=WAL")
+        self._read.execute(_SCHEMA)
+        self._write = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._write.execute("PRAGMA synchronous=NORMAL")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-memory")
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    # ─── resident set ──────────────────────────────────────────────────────────
+    def state(self, chat_id: int) -> ChatState:
+        st = self._resident.get(chat_id)
+        if st is not None:
+            self._resident.move_to_end(chat_id)
+            self.hits += 1
+            return st
+        row = self._unflushed.get(chat_id)
+        if row is None:
+            row = self._read.execute(
+                "SELECT chat_id, history, emoji, enabled FROM chat_memory WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        st = self._from_row(row) if row else self._new_state()
+        self._resident[chat_id] = st
+        self.loads += 1
+        self._evict()
+        return st
+
+    def _evict(self) -> None:
+        while len(self._resident) > self.resident_max:
+            cid, st = self._resident.popitem(last=False)
+            if cid in self._dirty:
+                self._dirty.discard(cid)
+                self._unflushed[cid] = self._to_row(cid, st)
+            self.evictions += 1
+
+    def _new_state(self) -> ChatState:
+        return ChatState(self.max_messages, self.context_chars, self.line_chars)
+
+    def _from_row(self, row: Row) -> ChatState:
+        _, history, emoji, enabled = row
+        return ChatState(
+            self.max_messages,
+            self.context_chars,
+            self.line_chars,
+            json.loads(history),
+            None if emoji is None else bool(emoji),
+            bool(enabled),
+        )
+
+    @staticmethod
+    def _to_row(chat_id: int, st: ChatState) -> Row:
+        history = json.dumps(list(st.history), ensure_ascii=False, separators=(",", ":"))
+        return (chat_id, history, None if st.emoji is None else int(st.emoji), int(st.enabled))
+
+    def _touch(self, chat_id: int) -> None:
+        self._dirty.add(chat_id)
+        if self.on_change is not None:
+            self.on_change()
+
+    # ─── accessors ─────────────────────────────────────────────────────────────
+    def history(self, chat_id: int) -> List[Entry]:
+        return list(self.state(chat_id).history)
+
+    def context(self, chat_id: int) -> str:
+        """Rendered history within the character budget, oldest first."""
+        return self.state(chat_id).context()
+
+    def append(self, chat_id: int, role: str, content: str) -> None:
+        content = (content or "").strip()
+        if content:
+            self.state(chat_id).push(ROLES.get(role, "user"), content)
+            self._touch(chat_id)
+
+    def append_context(self, chat_id: int, content: str, keep: int) -> None:
+        """Unaddressed group chatter: keep at most `keep` such lines so it can't crowd out the dialogue."""
+        content = (content or "").strip()
+        if not content:
+            return
+        st = self.state(chat_id)
+        st.push("context", content)
+        n = sum(1 for r, _ in st.history if r == "context")
+        if n > keep:
+            for i, (r, _) in enumerate(st.history):
+                if r == "context":
+                    st.drop(i)
+                    break
+        self._touch(chat_id)
+
+    def emoji_allowed(self, chat_id: int) -> bool:
+        return self.state(chat_id).emoji is not False
+
+    def set_emoji(self, chat_id: int, allow: bool) -> None:
+        st = self.state(chat_id)
+        if st.emoji is not allow:
+            st.emoji = allow
+            self._touch(chat_id)
+
+    def is_enabled(self, chat_id: int) -> bool:
+        return self.state(chat_id).enabled
+
+    def set_enabled(self, chat_id: int, on: bool) -> None:
+        st = self.state(chat_id)
+        if st.enabled != on:
+            st.enabled = on
+            self._touch(chat_id)
+
+    # ─── persistence ───────────────────────────────────────────────────────────
+    def _take_dirty(self) -> Dict[int, Row]:
+        for cid in self._dirty:
+            st = self._resident.get(cid)
+            if st is not None:
+                self._unflushed[cid] = self._to_row(cid, st)
+        self._dirty.clear()
+        return dict(self._unflushed)
+
+    def _write_rows(self, rows: Dict[int, Row]) -> None:
+        blank = json.dumps([])
+        with self._write:
+            self._write.execute("BEGIN")
+            for cid, row in rows.items():
+                if row[1] == blank and row[2] is None and not row[3]:
+                    self._write.execute("DELETE FROM chat_memory WHERE chat_id = ?", (cid,))
+                else:
+                    self._write.execute(
+                        "INSERT OR REPLACE INTO chat_memory (chat_id, history, emoji, enabled) VALUES (?, ?, ?, ?)",
+                        row,
+                    )
+
+    def _written(self, rows: Dict[int, Row]) -> None:
+        for cid, row in rows.items():
+            if self._unflushed.get(cid) is row:  # not changed again while the write ran
+                del self._unflushed[cid]
+
+    async def flush(self) -> int:
+        """Write every changed chat in one transaction off the loop; returns chats written."""
+        rows = self._take_dirty()
+        if rows:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._write_rows, rows)
+            self._written(rows)
+        return len(rows)
+
+    def flush_sync(self) -> int:
+        """Blocking flush for shutdown; queued behind any background write."""
+        rows = self._take_dirty()
+        if rows:
+            self._executor.submit(self._write_rows, rows).result()
+            self._written(rows)
+        return len(rows)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty) + len(self._unflushed)
+
+    def is_empty(self) -> bool:
+        return self._read.execute("SELECT 1 FROM chat_memory LIMIT 1").fetchone() is None
+
+    def import_json(self, json_path: str) -> int:
+        """One-time migration from the old memory.json ({chat_id: [{role, content}, …]})."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rows: Dict[int, Row] = {}
+        for k, msgs in data.items():
+            st = self._new_state()
+            for m in msgs:
+                content = (m.get("content", "") or "").strip()
+                if content.startswith("[group context] "):
+                    st.push("context", content[len("[group context] "):])
+                elif content:
+                    st.push(ROLES.get(m.get("role"), "user"), content)
+            rows[int(k)] = self._to_row(int(k), st)
+        self._write_rows(rows)
+        return len(rows)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._read.close()
+        self._write.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "resident": len(self._resident),
+            "pending_writes": self.pending,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+def open_memory(
+    db_path: str,
+    max_messages: int,
+    resident_max: int,
+    legacy_json: str = "",
+    on_change: Optional[Callable[[], None]] = None,
+    context_chars: int = 4000,
+    line_chars: int = 600,
+) -> ChatMemory:
+    """
+    Open the per-chat memory database. On first start (empty database) the
+    old memory.json is imported and renamed to *.migrated.
+    """
+    mem = ChatMemory(db_path, max_messages, resident_max, on_change, context_chars, line_chars)
+    if legacy_json and os.path.isfile(legacy_json) and mem.is_empty():
+        try:
+            n = mem.import_json(legacy_json)
+            os.replace(legacy_json, legacy_json + ".migrated")
+            logger.info(f"Migrated memory of {n} chats from {legacy_json} to {db_path}")
+        except Exception as e:
+            logger.warning(f"Failed to migrate {legacy_json}: {e}")
+    return mem
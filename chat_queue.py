@@ -0,0 +1,136 @@
+# chat_queue.py — bounded worker pool for SafoneAPI chat replies
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+CHAT_WORKERS      = int(os.getenv("CHAT_WORKERS", "4"))         # concurrent upstream calls
+CHAT_QUEUE_MAX    = int(os.getenv("CHAT_QUEUE_MAX", "64"))      # pending jobs across all chats
+CHAT_PER_CHAT_MAX = int(os.getenv("CHAT_PER_CHAT_MAX", "3"))    # pending jobs for a single chat
+CHAT_DEADLINE     = float(os.getenv("CHAT_DEADLINE", "45"))     # seconds from enqueue to reply
+
+T = TypeVar("T")
+Job = Tuple[Callable[[], Awaitable], asyncio.Future, float]  # (factory, result future, deadline)
+
+class Busy(Exception):
+    """Raised by ChatQueue.run when the job would exceed the queue limits."""
+
+class ChatQueue:
+    """
+    Jobs of one chat run strictly one after another, in arrival order, so
+    replies never overtake each other. Chats with pending work wait in a
+    shared ready queue that a fixed set of workers drains round-robin: a
+    busy group gets one worker at a time and cannot starve other chats.
+    Submissions beyond the limits are shed with Busy instead of piling up.
+    """
+
+    def __init__(
+        self,
+        workers: int = CHAT_WORKERS,
+        max_pending: int = CHAT_QUEUE_MAX,
+        per_chat: int = CHAT_PER_CHAT_MAX,
+        deadline: float = CHAT_DEADLINE,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_chat = per_chat
+        self.deadline = deadline
+        self._chats: Dict[int, Deque[Job]] = {}  # chat_id → pending jobs (chat is queued or running)
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self.pending = 0
+        self.running = 0
+        self.shed = 0
+        self.expired = 0
+        self.done = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for jobs in self._chats.values():
+            for _, fut, _ in jobs:
+                if not fut.done():
+                    fut.cancel()
+        self._chats.clear()
+        self.pending = 0
+
+    async def run(self, chat_id: int, factory: Callable[[], Awaitable[T]]) -> T:
+        """Queue factory() behind earlier jobs of chat_id and wait for its result."""
+        if not self._tasks:
+            self.start()
+        jobs = self._chats.get(chat_id)
+        if self.pending >= self.max_pending or (jobs is not None and len(jobs) >= self.per_chat):
+            self.shed += 1
+            raise Busy(chat_id)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        job = (factory, fut, loop.time() + self.deadline)
+        self.pending += 1
+        if jobs is None:
+            self._chats[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            jobs.append(job)  # the chat is already queued or running; its worker picks this up
+        return await asyncio.shield(fut)
+
+    async def _worker(self, n: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            jobs = self._chats.get(chat_id)
+            if not jobs:
+                self._chats.pop(chat_id, None)
+                continue
+            factory, fut, deadline = jobs[0]
+            remaining = deadline - loop.time()
+            self.running += 1
+            try:
+                if remaining <= 0:
+                    self.expired += 1
+                    raise asyncio.TimeoutError()
+                result = await asyncio.wait_for(factory(), timeout=remaining)
+            except asyncio.CancelledError:
+                if not fut.done():
+                    fut.cancel()
+                raise
+            except BaseException as e:
+                if isinstance(e, asyncio.TimeoutError) and remaining > 0:
+                    self.expired += 1
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(result)
+            finally:
+                self.running -= 1
+                self.pending -= 1
+                self.done += 1
+                jobs.popleft()
+                if jobs:
+                    self._ready.put_nowait(chat_id)  # back of the line: other chats go first
+                else:
+                    self._chats.pop(chat_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self.pending,
+            "running": self.running,
+            "chats": len(self._chats),
+            "shed": self.shed,
+            "expired": self.expired,
+            "done": self.done,
+        }
+
+chat_queue = ChatQueue()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# check_cli.py — offline batch checker (no Telegram, no 1000-number cap)
+#
+#   python check_cli.py numbers.txt -o results.jsonl --checkpoint run.ckpt
+#   echo "88800000000-88800099999" | python check_cli.py - --format csv
+#
+# Input: numbers or ranges (lo-hi, same syntax as /save), separated by commas,
+# spaces or newlines. Results stream out block by block; after each block the
+# checkpoint records how far the input got and how long the output was, so a
+# crashed run resumes exactly there without refetching finished numbers.
+import os
+import re
+import sys
+import csv
+import json
+import asyncio
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+import fragment_client
+import fragment_pool
+import saves_store
+
+logger = logging.getLogger("check_cli")
+
+STATUS = {True: "restricted", False: "free", None: "unknown"}
+
+# ─── Input ─────────────────────────────────────────────────────────────────────
+def iter_numbers(src: TextIO) -> Iterator[str]:
+    """Yield canonical numbers lazily; ranges are expanded one int at a time."""
+    for line in src:
+        for tok in re.split(r"[,\s]+", line.strip()):
+            if not tok:
+                continue
+            try:
+                rng = saves_store.parse_range(tok)
+            except saves_store.RangeError as e:
+                logger.warning(f"{e}, skipped")
+                continue
+            if rng:
+                for n in range(rng[0], rng[1] + 1):
+                    yield str(n)
+                continue
+            num = fragment_client.canonical(tok)
+            if num:
+                yield num
+
+def _blocks(it: Iterator[str], size: int) -> Iterator[List[str]]:
+    block: List[str] = []
+    for n in it:
+        block.append(n)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+# ─── Checkpoints ───────────────────────────────────────────────────────────────
+def _new_stats() -> Dict[str, int]:
+    return {"checked": 0, "restricted": 0, "free": 0, "unknown": 0}
+
+def load_checkpoint(path: str) -> Tuple[int, Optional[int], Dict[str, int]]:
+    """Return (numbers already consumed, output byte length at that point, counts so far)."""
+    stats = _new_stats()
+    if not path or not os.path.isfile(path):
+        return 0, None, stats
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    stats.update({k: int(v) for k, v in (data.get("stats") or {}).items() if k in stats})
+    return int(data.get("consumed", 0)), data.get("output_bytes"), stats
+
+def save_checkpoint(path: str, consumed: int, output_bytes: Optional[int], stats: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"consumed": consumed, "output_bytes": output_bytes, "stats": stats}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# ─── Output ────────────────────────────────────────────────────────────────────
+class _Writer:
+    def __init__(self, out: TextIO, fmt: str, header: bool):
+        self.out = out
+        self.fmt = fmt
+        self._csv = csv.writer(out) if fmt == "csv" else None
+        if self._csv and header:
+            self._csv.writerow(["number", "status"])
+
+    def write(self, num: str, restricted: Optional[bool]) -> None:
+        if self._csv:
+            self._csv.writerow([num, STATUS[restricted]])
+        else:
+            self.out.write(json.dumps({"number": num, "restricted": restricted, "status": STATUS[restricted]}) + "\n")
+
+# ─── Runner ────────────────────────────────────────────────────────────────────
+async def run(args: argparse.Namespace) -> dict:
+    skip, out_bytes, stats = load_checkpoint(args.checkpoint) if args.resume else (0, None, _new_stats())
+
+    if args.output == "-":
+        out: TextIO = sys.stdout
+        header = skip == 0
+    else:
+        append = bool(skip) and os.path.isfile(args.output)
+        out = open(args.output, "r+" if append else "w", encoding="utf-8", newline="")
+        if append:
+            # drop rows written after the last checkpoint (the crashed, unfinished block)
+            out.truncate(out_bytes if out_bytes is not None else os.path.getsize(args.output))
+            out.seek(0, os.SEEK_END)
+        header = not append
+    writer = _Writer(out, args.format, header)
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    checker = fragment_client.FragmentChecker(
+        timeout=args.timeout, base_url=args.base_url, workers=args.workers
+    )
+    consumed = 0
+    nums = iter_numbers(src)
+    try:
+        # fast-forward past what a previous run already finished
+        for _ in range(skip):
+            if next(nums, None) is None:
+                break
+            consumed += 1
+        if skip:
+            logger.info(f"resuming after {consumed} numbers")
+
+        for block in _blocks(nums, args.block):
+            async for num, ok in checker.check_many(block):
+                writer.write(num, ok)
+                stats["checked"] += 1
+                stats[STATUS[ok]] += 1
+            out.flush()
+            consumed += len(block)
+            if args.checkpoint:
+                pos = None if out is sys.stdout else os.fstat(out.fileno()).st_size
+                save_checkpoint(args.checkpoint, consumed, pos, stats)
+            logger.info(
+                f"{consumed} done · {stats['restricted']} restricted · {stats['unknown']} unknown · "
+                f"limiter={fragment_client.limiter.stats()['limit']}"
+            )
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+        await fragment_client.close_session()
+        fragment_pool.shutdown()
+    return stats
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Check fragment.com restriction status in bulk.")
+    p.add_argument("input", nargs="?", default="-", help="file with numbers/ranges, or - for stdin")
+    p.add_argument("-o", "--output", default="-", help="output file, or - for stdout (default)")
+    p.add_argument("-f", "--format", choices=("jsonl", "csv"), default="jsonl")
+    p.add_argument("--checkpoint", default="", help="checkpoint file written after every block")
+    p.add_argument("--no-resume", dest="resume", action="store_false", help="ignore an existing checkpoint")
+    p.add_argument("--block", type=int, default=2000, help="numbers per checkpointed block")
+    p.add_argument("--timeout", type=float, default=fragment_client.CHECK_TIMEOUT, help="per-request timeout cap")
+    p.add_argument("--workers", type=int, default=0, help="worker processes (0 = FRAGMENT_WORKERS, in-process if unset)")
+    p.add_argument("--base-url", default="https://fragment.com", help="override for local stand-ins")
+    return p
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", stream=sys.stderr)
+    if args.workers or fragment_pool.PROCESS_WORKERS:
+        fragment_pool.start(args.workers)  # fork before the event loop starts resolver threads
+    stats = asyncio.run(run(args))
+    logger.info(f"finished: {stats}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
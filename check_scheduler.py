@@ -0,0 +1,187 @@
+# check_scheduler.py — admission of heavy per-user check jobs (/checkall)
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOBS_MAX       = int(os.getenv("CHECK_JOBS_MAX", "4"))         # bulk jobs running bot-wide
+JOBS_PER_USER  = int(os.getenv("CHECK_JOBS_PER_USER", "1"))    # bulk jobs running per user
+QUEUE_MAX      = int(os.getenv("CHECK_QUEUE_MAX", "50"))       # jobs waiting bot-wide
+QUEUE_PER_USER = int(os.getenv("CHECK_QUEUE_PER_USER", "3"))   # jobs waiting per user
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+class QueueFull(Exception):
+    """Raised when a job would exceed CHECK_QUEUE_MAX waiting jobs."""
+
+class UserQueueFull(QueueFull):
+    """Raised when one user already has CHECK_QUEUE_PER_USER jobs waiting."""
+
+class _Ticket:
+    __slots__ = ("uid", "admitted", "moved")
+
+    def __init__(self, uid: int):
+        self.uid = uid
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.moved = asyncio.Event()  # set whenever the queue ahead of us changed
+
+class JobScheduler:
+    """
+    Runs at most max_jobs jobs at once and at most per_user per user. Waiting
+    jobs are admitted round-robin across users (whoever was admitted longest
+    ago goes first), so one user queuing several big checks does not hold
+    everyone else back. Which fetches of the running jobs go first is decided
+    by the limiter's fair queue (fragment_client).
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = JOBS_MAX,
+        per_user: int = JOBS_PER_USER,
+        queue_max: int = QUEUE_MAX,
+        queue_per_user: int = QUEUE_PER_USER,
+    ):
+        self.max_jobs = max(1, max_jobs)
+        self.per_user = max(1, per_user)
+        self.queue_max = queue_max
+        self.queue_per_user = queue_per_user
+        self._running: Dict[int, int] = {}
+        self._waiting: "OrderedDict[int, Deque[_Ticket]]" = OrderedDict()  # arrival order breaks ties
+        self._turn: Dict[int, int] = {}  # uid → admission count at its last admission, while running or waiting
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def _order(self) -> List[_Ticket]:
+        """Waiting tickets in the order round-robin would admit them (ignoring per-user caps)."""
+        queues = [list(self._waiting[u]) for u in sorted(self._waiting, key=self._last_turn)]
+        out: List[_Ticket] = []
+        depth = 0
+        while len(out) < self.queued:
+            out += [q[depth] for q in queues if depth < len(q)]
+            depth += 1
+        return out
+
+    def _last_turn(self, uid: int) -> int:
+        return self._turn.get(uid, -1)
+
+    def _start(self, uid: int) -> None:
+        self._running[uid] = self._running.get(uid, 0) + 1
+        self._turn[uid] = self.admitted
+        self.admitted += 1
+
+    def _notify(self) -> None:
+        for q in self._waiting.values():
+            for t in q:
+                t.moved.set()
+
+    def position(self, ticket: _Ticket) -> int:
+        order = self._order()
+        return order.index(ticket) + 1 if ticket in order else 0
+
+    def _admit(self) -> None:
+        changed = False
+        while self.running < self.max_jobs:
+            eligible = [u for u in self._waiting if self._running.get(u, 0) < self.per_user]
+            if not eligible:
+                break
+            uid = min(eligible, key=self._last_turn)
+            q = self._waiting[uid]
+            ticket = q.popleft()
+            if not q:
+                del self._waiting[uid]
+            self._start(uid)
+            ticket.admitted.set_result(None)
+            changed = True
+        if changed:
+            self._notify()
+
+    def _release(self, uid: int) -> None:
+        n = self._running.get(uid, 0) - 1
+        if n > 0:
+            self._running[uid] = n
+        else:
+            self._running.pop(uid, None)
+            if uid not in self._waiting:
+                self._turn.pop(uid, None)
+        self._admit()
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        q = self._waiting.get(ticket.uid)
+        if q is not None and ticket in q:
+            q.remove(ticket)
+            if not q:
+                del self._waiting[ticket.uid]
+                if ticket.uid not in self._running:
+                    self._turn.pop(ticket.uid, None)
+            self._notify()
+
+    @asynccontextmanager
+    async def slot(self, uid: int, on_position: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        """
+        Hold a job slot for uid. While waiting, on_position(n) is awaited
+        every time the 1-based queue position changes. Raises QueueFull
+        (UserQueueFull when uid alone has too many jobs waiting).
+        """
+        if self.running < self.max_jobs and self._running.get(uid, 0) < self.per_user and not self._waiting:
+            self._start(uid)
+        else:
+            if len(self._waiting.get(uid, ())) >= self.queue_per_user:
+                self.rejected += 1
+                raise UserQueueFull()
+            if self.queued >= self.queue_max:
+                self.rejected += 1
+                raise QueueFull()
+            ticket = _Ticket(uid)
+            self._waiting.setdefault(uid, deque()).append(ticket)
+            self._notify()  # a newcomer can take a turn ahead of users with several jobs waiting
+            self._admit()
+            last = -1
+            try:
+                while not ticket.admitted.done():
+                    pos = self.position(ticket)
+                    if pos != last and on_position is not None:
+                        last = pos
+                        try:
+                            await on_position(pos)
+                        except Exception as e:
+                            logger.debug(f"position update failed: {e!r}")
+                        continue  # the queue may have moved while we were reporting
+                    ticket.moved.clear()
+                    moved = asyncio.ensure_future(ticket.moved.wait())
+                    try:
+                        await asyncio.wait({ticket.admitted, moved}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        moved.cancel()
+            except BaseException:
+                if ticket.admitted.done():
+                    self._release(uid)  # admitted just as we were cancelled
+                else:
+                    self._withdraw(ticket)
+                raise
+        try:
+            yield
+        finally:
+            self._release(uid)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "users_waiting": len(self._waiting),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+scheduler = JobScheduler()
@@ -2,12 +2,12 @@
 import sys
 import os
 import re
-import json
 import asyncio
 import logging
-from typing import List, Dict, Tuple, Optional
+from collections import OrderedDict
+from typing import List, Dict, Set, Tuple, Optional
 
-import aiohttp
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import (
     Message,
@@ -16,6 +16,12 @@ from aiogram.types import (
     InputTextMessageContent,
 )
 
+import check_scheduler
+import fragment_client
+import fragment_pool
+import metrics
+import saves_store
+
 # ─── Grab dispatcher from main bot.py (aiogram v3) ─────────────────────────────
 _main = sys.modules["__main__"]
 dp = getattr(_main, "dp")
@@ -23,117 +29,119 @@ dp = getattr(_main, "dp")
 logger = logging.getLogger(__name__)
 
 # ─── Persistence setup ─────────────────────────────────────────────────────────
-_SAVES_FILE = os.path.join(os.getcwd(), "saves.json")
-_saves: Dict[int, List[str]] = {}  # user_id → list of canonical numbers
-_MAX_SAVE = 1000  # raised to 1000
+_SAVES_FILE = os.path.join(os.getcwd(), "saves.json")   # legacy, imported once into the DB
+_SAVES_DB = os.getenv("SAVES_DB", os.path.join(os.getcwd(), "saves.db"))
+_saves: Dict[int, saves_store.NumberSet] = {}  # user_id → sorted int64 set of numbers
+_MAX_SAVE = int(os.getenv("MAX_SAVE", "50000"))  # per user; 8 bytes each in memory
+_store: Optional[saves_store.SavesStore] = None
+_PERSIST_SECONDS = metrics.histogram("saves_persist_seconds", "Time to persist /save and /clearall changes")
 
 def load_saves() -> None:
-    global _saves
-    if os.path.isfile(_SAVES_FILE):
-        try:
-            with open(_SAVES_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            _saves = {int(k): list(map(str, v)) for k, v in data.items()}
-        except Exception as e:
-            logger.warning(f"Failed to load saves.json: {e}")
-            _saves = {}
-
-def save_saves() -> None:
+    global _saves, _store
+    try:
+        _store = saves_store.open_store(_SAVES_DB, legacy_json=_SAVES_FILE)
+        _saves = _store.load_all()
+    except Exception as e:
+        logger.warning(f"Failed to load {_SAVES_DB}: {e}")
+        _saves = {}
+
+async def persist_added(uid: int, nums: List[int]) -> None:
+    """Write only the newly added numbers, off the event loop."""
+    if _store is None:
+        return
     try:
-        with open(_SAVES_FILE, "w", encoding="utf-8") as f:
-            json.dump(_saves, f, ensure_ascii=False)
+        with _PERSIST_SECONDS.time(op="add"):
+            await _store.add(uid, nums)
     except Exception as e:
-        logger.warning(f"Failed to write saves.json: {e}")
+        logger.warning(f"Failed to persist saves for {uid}: {e}")
+
+async def persist_cleared(uid: int) -> None:
+    if _store is None:
+        return
+    try:
+        with _PERSIST_SECONDS.time(op="clear"):
+            await _store.clear(uid)
+    except Exception as e:
+        logger.warning(f"Failed to clear saves for {uid}: {e}")
+
+# fork the checker workers (if any) now: bot.py has not started any threads yet
+if fragment_pool.PROCESS_WORKERS > 0:
+    fragment_pool.start()
 
 # load at import time
 load_saves()
 
-# ─── HTTP client defaults ──────────────────────────────────────────────────────
-_DEFAULT_HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/115.0.0.0 Safari/537.36"
-    ),
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    "Accept-Language": "en-US,en;q=0.9",
-}
-
-# Heuristics to detect "restricted" on fragment page
-_RESTRICT_PATTERNS = [
-    re.compile(r"\brestricted on Telegram\b", re.I),
-    re.compile(r"\bThis phone number is restricted\b", re.I),
-    re.compile(r"\bBlocked\b", re.I),
-]
+# ─── Shared HTTP pool lifecycle ────────────────────────────────────────────────
+@dp.startup()
+async def _open_client_pool():
+    fragment_client.get_session()
 
-# ─── Helpers ───────────────────────────────────────────────────────────────────
-def _canonical(tok: str) -> str:
-    """Keep digits only."""
-    return re.sub(r"\D", "", (tok or ""))
+@dp.shutdown()
+async def _close_client_pool():
+    await fragment_client.close_session()
+    fragment_pool.shutdown()
+    if _store is not None:
+        _store.close()
 
+# ─── Helpers ───────────────────────────────────────────────────────────────────
 def _user_id(msg: Message) -> int:
     return msg.from_user.id  # type: ignore[return-value]
 
-def _is_restricted_html(html: str) -> Optional[bool]:
-    """Return True if restricted, False if confidently not, None if unknown/error."""
-    if not html:
-        return None
-    for p in _RESTRICT_PATTERNS:
-        if p.search(html):
-            return True
-    # If page is reachable but no restricted markers found, treat as not restricted
-    return False
-
-async def _fetch_status(
-    session: aiohttp.ClientSession,
-    num: str,
-    sem: asyncio.Semaphore,
-    timeout_total: float,
-) -> Tuple[str, Optional[bool]]:
-    """
-    Returns (num, restricted):
-      True  → restricted
-      False → not restricted
-      None  → error / unknown
-    """
-    url = f"https://fragment.com/phone/{num}"
-    try:
-        async with sem:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout_total)) as resp:
-                text = await resp.text(errors="ignore")
-                res = _is_restricted_html(text)
-                return num, res
-    except Exception as e:
-        logger.warning(f"Fetch failed for {num}: {e!r}")
-        return num, None
-
-def _chunk_sendable(lines: List[str], chunk_size: int = 30) -> List[str]:
-    return ["\n".join(lines[i : i + chunk_size]) for i in range(0, len(lines), chunk_size)]
+def saved_numbers(uid: int) -> List[str]:
+    """User's saved numbers as sorted, unique canonical strings."""
+    nums = _saves.get(uid)
+    return nums.as_strings() if nums else []
 
 # ─── /save handler ─────────────────────────────────────────────────────────────
 @dp.message(Command("save"))
 async def save_numbers(message: Message):
     parts = message.text.strip().split(maxsplit=1) if message.text else []
     if len(parts) < 2:
-        return await message.reply("⚠️ Usage: `/save <num1>[,| ]<num2> …`", parse_mode="Markdown")
+        return await message.reply(
+            "⚠️ Usage: `/save <num1>[,| ]<num2> …` or `/save 888000100-888000999`",
+            parse_mode="Markdown",
+        )
 
     raw = re.split(r"[,\s]+", parts[1])
     uid = _user_id(message)
-    store = _saves.setdefault(uid, [])
-    added = 0
+    store = _saves.setdefault(uid, saves_store.NumberSet())
+    new: List[int] = []
+    singles: List[int] = []
+    notes: List[str] = []
 
     for tok in raw:
-        num = _canonical(tok)
-        if not num:
+        try:
+            rng = saves_store.parse_range(tok)
+        except saves_store.RangeError as e:
+            notes.append(f"⚠️ {e}, skipped.")
             continue
-        if len(store) >= _MAX_SAVE:
-            break
-        if num not in store:
-            store.append(num)
-            added += 1
-
-    save_saves()
-    await message.reply(f"✅ Added {added} number(s). Total stored: {len(store)}/{_MAX_SAVE}.")
+        if rng:
+            lo, hi = rng
+            size = hi - lo + 1
+            have = store.count_range(lo, hi)
+            room = max(0, _MAX_SAVE - len(store))
+            if size - have > room:
+                notes.append(f"⚠️ {tok}: {size} numbers, only {room} more fit (limit {_MAX_SAVE}), skipped.")
+                continue
+            new += store.add_range(lo, hi, _MAX_SAVE)
+            notes.append(f"↔️ {tok}: {size} numbers" + (f" ({have} already saved)" if have else ""))
+            continue
+        num = fragment_client.canonical(tok)
+        if num and len(num) <= saves_store.MAX_DIGITS:
+            singles.append(int(num))
+    wanted = len({n for n in singles if n not in store})
+    added = store.add_many(singles, _MAX_SAVE)
+    if len(added) < wanted:
+        notes.append(f"⚠️ {wanted - len(added)} number(s) did not fit (limit {_MAX_SAVE}).")
+    new += added
+
+    await persist_added(uid, new)
+    if len(notes) > 20:
+        notes[20:] = [f"…and {len(notes) - 20} more."]
+    await message.reply(
+        f"✅ Added {len(new)} number(s). Total stored: {len(store)}/{_MAX_SAVE}."
+        + "".join("\n" + n for n in notes)
+    )
 
 # ─── /clearall handler ─────────────────────────────────────────────────────────
 @dp.message(Command("clearall"))
@@ -141,109 +149,281 @@ async def clear_numbers(message: Message):
     uid = _user_id(message)
     if uid in _saves:
         _saves.pop(uid, None)
-        save_saves()
+        await persist_cleared(uid)
     await message.reply("🗑️ All your saved numbers have been cleared.")
 
 # ─── /checkall handler (ONLY restricted + unknown) ─────────────────────────────
+_PROGRESS_EVERY = 3.0    # seconds between status-message edits
+_STREAM_CHUNK = 30       # restricted numbers per streamed message
+_REPLY_ATTEMPTS = 3      # flood-limited replies are retried this often
+_running_checks: Dict[int, Set[asyncio.Event]] = {}  # user_id → cancel flags of running/queued /checkall
+
+metrics.register_gauges("check_jobs", check_scheduler.scheduler.stats)
+
+def _progress_text(done: int, total: int, restricted: int, unknown: int, elapsed: float) -> str:
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = f"{(total - done) / rate:.0f}s" if rate > 0 else "…"
+    return (
+        f"⏳ Checking {total} numbers…\n"
+        f"✔️ {done}/{total} done · 🔒 {restricted} restricted · ⚠️ {unknown} unknown\n"
+        f"⚡ {rate:.1f}/s · ETA {eta}\n"
+        f"Send /cancel to stop."
+    )
+
+async def _reply(message: Message, text: str, **kw) -> Message:
+    """message.reply that waits out Telegram flood limits instead of failing."""
+    for attempt in range(1, _REPLY_ATTEMPTS + 1):
+        try:
+            return await message.reply(text, **kw)
+        except TelegramRetryAfter as e:
+            if attempt == _REPLY_ATTEMPTS:
+                raise
+            await asyncio.sleep(e.retry_after)
+
 @dp.message(Command("checkall"))
 async def check_all(message: Message):
     uid = _user_id(message)
-    nums = _saves.get(uid, [])
+    nums = saved_numbers(uid)  # already unique + sorted
     if not nums:
         return await message.reply("📭 No numbers saved. Use `/save` first.", parse_mode="Markdown")
 
-    # normalize, dedupe, sort
-    nums = sorted(set(_canonical(n) for n in nums if _canonical(n)))
-    status_msg = await message.reply(f"⏳ Checking {len(nums)} numbers…")
+    total = len(nums)
+    status_msg = await message.reply(f"⏳ Checking {total} numbers…")
+
+    cancel = asyncio.Event()
+    _running_checks.setdefault(uid, set()).add(cancel)
+
+    restricted: List[str] = []
+    unknown: List[str] = []
+    batch: List[str] = []       # restricted, not streamed yet
+    streaming = True            # false once a chunk could not be sent; the rest goes into the summary
+    done_count = 0
+    started = last_edit = asyncio.get_running_loop().time()
+
+    async def _flush(final: bool = False) -> None:
+        # stream restricted numbers as soon as a chunk is full (or at the end)
+        nonlocal batch, streaming
+        while streaming and batch and (final or len(batch) >= _STREAM_CHUNK):
+            chunk = sorted(batch[:_STREAM_CHUNK])
+            first = len(restricted) - len(batch) + 1
+            lines = [
+                f"{i}. 🔒 <a href='https://fragment.com/phone/{num}'>{num}</a>"
+                for i, num in enumerate(chunk, start=first)
+            ]
+            try:
+                await _reply(
+                    message,
+                    ("🔒 Restricted found:\n" if first == 1 else "") + "\n".join(lines),
+                    parse_mode="HTML",
+                    disable_web_page_preview=True,
+                )
+            except Exception as e:
+                streaming = False  # don't let a delivery problem stop the check itself
+                logger.warning(f"checkall uid={uid}: streaming results failed: {e!r}")
+                return
+            batch = batch[_STREAM_CHUNK:]
+
+    async def _on_queued(pos: int) -> None:
+        await status_msg.edit_text(
+            f"🕒 Queued: {total} numbers, position {pos}.\n"
+            f"It starts as soon as a check slot is free. Send /cancel to drop it."
+        )
 
-    concurrency = min(len(nums), 80)
-    sem = asyncio.Semaphore(concurrency)
-    timeout_total = 8.0
-    conn = aiohttp.TCPConnector(limit_per_host=concurrency, ssl=False)
+    async def _consume() -> None:
+        nonlocal last_edit, started
+        async with check_scheduler.scheduler.slot(uid, _on_queued):
+            started = last_edit = asyncio.get_running_loop().time()
+            fragment_client.set_flow(fragment_client.BULK, uid)  # fair share of fetch slots per user
+            await _check()
 
-    async with aiohttp.ClientSession(connector=conn, headers=_DEFAULT_HEADERS) as sess:
-        results = await asyncio.gather(
-            *(_fetch_status(sess, n, sem, timeout_total) for n in nums),
-            return_exceptions=False,
+    async def _check() -> None:
+        nonlocal done_count, last_edit
+        results = fragment_client.checker.check_many(nums)
+        try:
+            async for num, ok in results:
+                done_count += 1
+                if ok is True:
+                    restricted.append(num)
+                    batch.append(num)
+                elif ok is None:
+                    unknown.append(num)
+                await _flush()
+
+                now = asyncio.get_running_loop().time()
+                if done_count < total and now - last_edit >= _PROGRESS_EVERY:
+                    last_edit = now
+                    try:
+                        await status_msg.edit_text(
+                            _progress_text(done_count, total, len(restricted), len(unknown), now - started)
+                        )
+                    except Exception:
+                        pass  # "message is not modified" / flood limits — progress is best-effort
+        finally:
+            await results.aclose()  # cancel pending fetches even if we stopped mid-flush
+
+    consumer = asyncio.ensure_future(_consume())
+    cancel_wait = asyncio.ensure_future(cancel.wait())
+    try:
+        await asyncio.wait({consumer, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        cancelled = not consumer.done()
+        if cancelled:
+            consumer.cancel()  # closes check_many → abandoned numbers stop using bandwidth
+        await asyncio.gather(consumer, return_exceptions=True)
+        cancel_wait.cancel()
+        flags = _running_checks.get(uid)
+        if flags is not None:
+            flags.discard(cancel)
+            if not flags:
+                _running_checks.pop(uid, None)
+    if not consumer.cancelled() and isinstance(consumer.exception(), check_scheduler.UserQueueFull):
+        return await status_msg.edit_text(
+            f"⏳ You already have {check_scheduler.scheduler.queue_per_user} checks waiting. "
+            f"Let them finish or send /cancel first."
         )
+    if not consumer.cancelled() and isinstance(consumer.exception(), check_scheduler.QueueFull):
+        return await status_msg.edit_text("⏳ Too many checks are queued right now. Please try again later.")
+    failed = not cancelled and (consumer.exception() is not None or done_count < total)
+    if failed:
+        logger.error(f"checkall uid={uid} failed after {done_count}/{total}: {consumer.exception()!r}")
+
+    await _flush(final=True)
+    logger.info(f"checkall uid={uid} n={total} done={done_count} limiter={fragment_client.limiter.stats()}")
 
     try:
         await status_msg.delete()
     except Exception:
         pass
 
-    # Partition (no "free" reporting)
-    restricted = [n for n, ok in results if ok is True]
-    unknown = [n for n, ok in results if ok is None]
-
-    total = len(nums)
-
     # Summary without free
-    await message.reply(
-        f"📊 Done.\n"
-        f"🔒 Restricted: {len(restricted)}/{total}\n"
-        f"⚠️ Unknown: {len(unknown)}",
+    if cancelled:
+        head = f"🛑 Cancelled after {done_count}/{total}.\n"
+    elif failed:
+        head = f"⚠️ Incomplete: the check stopped after {done_count}/{total} because of an error.\n"
+    else:
+        head = "📊 Done.\n"
+    await _reply(
+        message,
+        head
+        + f"🔒 Restricted: {len(restricted)}/{total}\n"
+        + f"⚠️ Unknown: {len(unknown)}",
         disable_web_page_preview=True,
     )
 
-    # Send restricted list (numbered + links)
-    if restricted:
-        header = f"🔒 Restricted: {len(restricted)}/{total}\n"
-        lines = [
-            f"{i}. 🔒 <a href='https://fragment.com/phone/{num}'>{num}</a>"
-            for i, num in enumerate(restricted, start=1)
-        ]
-        for i, chunk in enumerate(_chunk_sendable(lines, 30)):
-            await message.reply(
-                (header if i == 0 else "") + chunk,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
-    else:
-        await message.reply(f"✅ No restricted numbers found out of {total} checked.")
+    if not restricted and not cancelled and not failed:
+        await _reply(message, f"✅ No restricted numbers found out of {total} checked.")
+
+    # Restricted numbers that could not be streamed above
+    if batch:
+        batch.sort()
+        more = "" if len(batch) <= 100 else f"\n…and {len(batch) - 100} more."
+        await _reply(message, "🔒 Restricted (not listed above):\n" + "\n".join(batch[:100]) + more)
 
     # Report unknowns
     if unknown:
+        unknown.sort()
         unk_lines = "\n".join(unknown[:100])
         more = "" if len(unknown) <= 100 else f"\n…and {len(unknown) - 100} more."
-        await message.reply("⚠️ Could not verify:\n" + unk_lines + more)
-
-# ─── Inline @bot query (ONLY restricted + unknown) ─────────────────────────────
-@dp.inline_query()
-async def inline_check(inline_q: InlineQuery):
-    uid = inline_q.from_user.id
-    nums = _saves.get(uid, [])
-
-    if not nums:
-        article = InlineQueryResultArticle(
-            id="no_saved",
-            title="📭 No saved numbers",
-            input_message_content=InputTextMessageContent(
-                "📭 No numbers saved. Use `/save` first.", parse_mode="HTML"
-            ),
-            description="Use /save to add numbers",
-        )
-        return await inline_q.answer([article], cache_time=0, is_personal=True)
-
-    nums = sorted(set(_canonical(n) for n in nums if _canonical(n)))
-
-    concurrency = min(len(nums), 50)
-    sem = asyncio.Semaphore(concurrency)
-    timeout_total = 5.0
-    conn = aiohttp.TCPConnector(limit_per_host=concurrency, ssl=False)
-
-    async with aiohttp.ClientSession(connector=conn, headers=_DEFAULT_HEADERS) as sess:
-        results = await asyncio.gather(
-            *(_fetch_status(sess, n, sem, timeout_total) for n in nums),
-            return_exceptions=False,
-        )
+        await _reply(message, "⚠️ Could not verify:\n" + unk_lines + more)
+
+# ─── /cancel handler (stops a running /checkall) ───────────────────────────────
+@dp.message(Command("cancel"))
+async def cancel_check(message: Message):
+    flags = _running_checks.get(_user_id(message))
+    if not flags:
+        return await message.reply("ℹ️ No check is running.")
+    for flag in flags:
+        flag.set()
+    await message.reply("🛑 Cancelling your check…" if len(flags) == 1 else f"🛑 Cancelling your {len(flags)} checks…")
+
+# ─── Inline answers: cached snapshot + background refresh ─────────────────────
+# Telegram gives inline queries only a few seconds, so inline never waits for a
+# full live scan: it answers from what is known and refreshes the rest behind.
+_INLINE_BUDGET = float(os.getenv("INLINE_BUDGET", "2.5"))   # seconds we may wait on a refresh
+_INLINE_USERS_MAX = int(os.getenv("INLINE_USERS_MAX", "1000"))  # users whose last verdicts we remember
+_last_batch: "OrderedDict[int, Dict[str, Optional[bool]]]" = OrderedDict()  # user_id → last known verdict per number (LRU)
+_refresh_tasks: Dict[int, asyncio.Task] = {}
+
+Snapshot = Tuple[Dict[str, Optional[bool]], Dict[str, Optional[bool]], List[str]]
+
+def _verdicts(uid: int) -> Dict[str, Optional[bool]]:
+    """uid's last known verdicts, created on first use; least recently used users are forgotten."""
+    last = _last_batch.get(uid)
+    if last is None:
+        last = _last_batch[uid] = {}
+        while len(_last_batch) > _INLINE_USERS_MAX:
+            _last_batch.popitem(last=False)
+    else:
+        _last_batch.move_to_end(uid)
+    return last
+
+def _snapshot(uid: int, nums: List[str]) -> Snapshot:
+    """Split nums into (fresh verdicts, stale verdicts, never checked)."""
+    last = _verdicts(uid)
+    fresh: Dict[str, Optional[bool]] = {}
+    stale: Dict[str, Optional[bool]] = {}
+    missing: List[str] = []
+    for n in nums:
+        hit, ok = fragment_client.status_cache.get(n)
+        if hit:
+            fresh[n] = ok
+        elif n in last:
+            stale[n] = last[n]
+        else:
+            missing.append(n)
+    # remember everything we know, forget numbers the user no longer saves; updated
+    # in place so verdicts a running refresh writes meanwhile are not lost
+    wanted = set(nums)
+    for n in [n for n in last if n not in wanted]:
+        del last[n]
+    last.update(fresh)
+    return fresh, stale, missing
+
+async def _refresh_batch(uid: int, nums: List[str]) -> None:
+    # only fetches started while an inline answer may still wait on them go ahead of
+    # bulk /checkall work; the rest of a big refresh queues as the user's bulk flow
+    loop = asyncio.get_running_loop()
+    foreground_until = loop.time() + _INLINE_BUDGET
+    fragment_client.set_flow(fragment_client.INTERACTIVE, uid)
+    async for num, ok in fragment_client.checker.check_many(nums):
+        _verdicts(uid)[num] = ok
+        if foreground_until and loop.time() >= foreground_until:
+            fragment_client.set_flow(fragment_client.BULK, uid)  # applies to fetches started from now on
+            foreground_until = 0.0
+
+async def inline_snapshot(uid: int, nums: List[str]) -> Snapshot:
+    """
+    Answer within _INLINE_BUDGET: start (or join) a background refresh of every
+    stale/unchecked number, wait for it only as long as the budget allows, and
+    return whatever is known by then.
+    """
+    fresh, stale, missing = _snapshot(uid, nums)
+    todo = list(stale) + missing
+    if not todo:
+        return fresh, stale, missing
+
+    task = _refresh_tasks.get(uid)
+    if task is None or task.done():
+        task = asyncio.create_task(_refresh_batch(uid, todo))
+        _refresh_tasks[uid] = task
+        task.add_done_callback(lambda t: _refresh_tasks.pop(uid, None) if _refresh_tasks.get(uid) is t else None)
+    try:
+        await asyncio.wait_for(asyncio.shield(task), _INLINE_BUDGET)
+    except asyncio.TimeoutError:
+        pass  # results land in the cache; the next query picks them up
+    except Exception:
+        logger.exception("inline refresh failed")
+    return _snapshot(uid, nums)
 
-    restricted = [n for n, ok in results if ok is True]
-    unknown = [n for n, ok in results if ok is None]
+def inline_article(snap: Snapshot) -> InlineQueryResultArticle:
+    fresh, stale, missing = snap
+    known = {**stale, **fresh}
+    restricted = sorted(n for n, ok in known.items() if ok is True)
+    unknown = sorted(n for n, ok in known.items() if ok is None)
 
     if restricted:
         body = "\n".join(
-            f"🔒 <a href='https://fragment.com/phone/{n}'>{n}</a>"
+            f"🔒 <a href='https://fragment.com/phone/{n}'>{n}</a>" + (" ⏳" if n in stale else "")
             for n in restricted[:400]  # keep inline message within limits
         )
     else:
@@ -254,12 +434,41 @@ async def inline_check(inline_q: InlineQuery):
         if len(unknown) > 20:
             body += f"\n…(+{len(unknown) - 20} more)"
 
+    if stale or missing:
+        body += f"\n\n⏳ {len(stale)} stale, {len(missing)} not checked yet — refreshing."
+
     title = f"🔍 Restricted: {len(restricted)} | ⚠️ Unknown: {len(unknown)}"
+    if missing:
+        title += f" | ⏳ {len(missing)} pending"
+    description = (
+        "Some results are stale — refreshing, query again in a moment"
+        if stale or missing
+        else "Show only restricted numbers (and unknown if any)"
+    )
 
-    article = InlineQueryResultArticle(
+    return InlineQueryResultArticle(
         id="restricted_only",
         title=title,
         input_message_content=InputTextMessageContent(body, parse_mode="HTML"),
-        description="Show only restricted numbers (and unknown if any)",
+        description=description,
     )
-    await inline_q.answer([article], cache_time=0, is_personal=True)
+
+# ─── Inline @bot query (ONLY restricted + unknown) ─────────────────────────────
+@dp.inline_query()
+async def inline_check(inline_q: InlineQuery):
+    uid = inline_q.from_user.id
+    nums = saved_numbers(uid)
+
+    if not nums:
+        article = InlineQueryResultArticle(
+            id="no_saved",
+            title="📭 No saved numbers",
+            input_message_content=InputTextMessageContent(
+                "📭 No numbers saved. Use `/save` first.", parse_mode="HTML"
+            ),
+            description="Use /save to add numbers",
+        )
+        return await inline_q.answer([article], cache_time=0, is_personal=True)
+
+    snap = await inline_snapshot(uid, nums)
+    await inline_q.answer([inline_article(snap)], cache_time=0, is_personal=True)
@@ -0,0 +1,760 @@
+# fragment_client.py
+import os
+import re
+import time
+import math
+import codecs
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ─── Pool settings (tunable via .env) ──────────────────────────────────────────
+POOL_LIMIT          = int(os.getenv("FRAGMENT_POOL_LIMIT", "100"))        # total open sockets
+POOL_LIMIT_PER_HOST = int(os.getenv("FRAGMENT_POOL_PER_HOST", "80"))      # sockets to fragment.com
+DNS_CACHE_TTL       = int(os.getenv("FRAGMENT_DNS_TTL", "300"))           # seconds
+KEEPALIVE_TIMEOUT   = float(os.getenv("FRAGMENT_KEEPALIVE", "30"))        # idle socket lifetime
+
+# ─── Status cache settings ─────────────────────────────────────────────────────
+CACHE_TTL_DEFINITE  = float(os.getenv("FRAGMENT_CACHE_TTL", "600"))       # True/False verdicts
+CACHE_TTL_UNKNOWN   = float(os.getenv("FRAGMENT_CACHE_TTL_UNKNOWN", "30")) # None (errors)
+CACHE_MAX_ENTRIES   = int(os.getenv("FRAGMENT_CACHE_MAX", "50000"))
+
+# ─── Page classifier settings ──────────────────────────────────────────────────
+CLASSIFY_CHUNK      = int(os.getenv("FRAGMENT_CHUNK_BYTES", "8192"))
+CLASSIFY_MAX_BYTES  = int(os.getenv("FRAGMENT_MAX_PAGE_BYTES", "524288"))  # stop reading after this
+DRAIN_MAX_BYTES     = int(os.getenv("FRAGMENT_DRAIN_BYTES", "65536"))      # drain leftovers to keep socket
+
+# ─── Adaptive concurrency (AIMD) settings ──────────────────────────────────────
+CONC_INITIAL        = int(os.getenv("FRAGMENT_CONC_INITIAL", "20"))
+CONC_MIN            = int(os.getenv("FRAGMENT_CONC_MIN", "4"))
+CONC_MAX            = int(os.getenv("FRAGMENT_CONC_MAX", str(POOL_LIMIT_PER_HOST)))
+LATENCY_TARGET      = float(os.getenv("FRAGMENT_LATENCY_TARGET", "2.5"))  # grow only below this
+BACKOFF_FACTOR      = float(os.getenv("FRAGMENT_BACKOFF_FACTOR", "0.5"))
+BACKOFF_COOLDOWN    = float(os.getenv("FRAGMENT_BACKOFF_COOLDOWN", "1.0")) # min seconds between decreases
+BACKOFF_WINDOW      = int(os.getenv("FRAGMENT_BACKOFF_WINDOW", "100"))    # recent responses judged together
+BACKOFF_ERROR_RATE  = float(os.getenv("FRAGMENT_BACKOFF_RATE", "0.1"))    # timeouts/429/5xx share that backs off
+MIN_TIMEOUT         = float(os.getenv("FRAGMENT_MIN_TIMEOUT", "2.0"))
+
+# ─── Retry / hedging settings ──────────────────────────────────────────────────
+RETRY_ATTEMPTS      = int(os.getenv("FRAGMENT_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY    = float(os.getenv("FRAGMENT_RETRY_BASE", "0.25"))
+RETRY_MAX_DELAY     = float(os.getenv("FRAGMENT_RETRY_MAX_DELAY", "2.0"))
+RETRY_BUDGET        = float(os.getenv("FRAGMENT_RETRY_BUDGET", "15"))      # seconds per number, all attempts
+HEDGE_ENABLED       = os.getenv("FRAGMENT_HEDGE", "1") == "1"
+HEDGE_PERCENTILE    = float(os.getenv("FRAGMENT_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATIO     = float(os.getenv("FRAGMENT_HEDGE_MAX_RATIO", "0.1"))  # hedges per attempt
+
+# ─── Batch settings ────────────────────────────────────────────────────────────
+CHECK_TIMEOUT       = float(os.getenv("FRAGMENT_TIMEOUT", "8"))           # per-attempt cap
+BATCH_WINDOW        = int(os.getenv("FRAGMENT_BATCH_WINDOW", "400"))      # tasks alive per batch
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/115.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# ─── Shared session (one per process) ──────────────────────────────────────────
+_session: Optional[aiohttp.ClientSession] = None
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the process-wide ClientSession, creating it on first use.
+    Keeps sockets alive between checks so DNS/TCP/TLS setup is paid once.
+    Must be called from inside a running event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        conn = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            use_dns_cache=True,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            enable_cleanup_closed=True,
+            ssl=False,
+        )
+        _session = aiohttp.ClientSession(connector=conn, headers=DEFAULT_HEADERS)
+        logger.info(
+            f"fragment client pool opened (limit={POOL_LIMIT}, per_host={POOL_LIMIT_PER_HOST}, "
+            f"dns_ttl={DNS_CACHE_TTL}s)"
+        )
+    return _session
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("fragment client pool closed")
+    _session = None
+
+# ─── Per-number status cache (TTL + LRU) ───────────────────────────────────────
+class StatusCache:
+    """
+    In-memory cache of restriction verdicts keyed by canonical number.
+    Definite verdicts (True/False) and unknowns (None) expire separately;
+    once max_entries is reached the least recently used entry is evicted.
+    """
+
+    def __init__(
+        self,
+        ttl_definite: float = CACHE_TTL_DEFINITE,
+        ttl_unknown: float = CACHE_TTL_UNKNOWN,
+        max_entries: int = CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_definite = ttl_definite
+        self.ttl_unknown = ttl_unknown
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Optional[bool]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, num: str) -> Tuple[bool, Optional[bool]]:
+        """Return (hit, restricted). On a miss restricted is None."""
+        entry = self._data.get(num)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(num)
+                self.hits += 1
+                return True, value
+            del self._data[num]
+        self.misses += 1
+        return False, None
+
+    def put(self, num: str, value: Optional[bool]) -> None:
+        ttl = self.ttl_unknown if value is None else self.ttl_definite
+        if ttl <= 0:
+            return
+        self._data[num] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(num)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+status_cache = StatusCache()
+
+# ─── Single-flight coalescing of concurrent fetches ────────────────────────────
+class SingleFlight:
+    """
+    Ensures at most one fetch per key is in flight. Concurrent callers for the
+    same key await the leader's task instead of issuing their own request.
+    The shared task is cancelled only when every waiter has gone away.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            self._tasks.pop(key, None)
+            self._waiters.pop(key, None)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Optional[bool]]]) -> Optional[bool]:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+            self.leaders += 1
+        else:
+            self.joined += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] <= 0 and not task.done():
+                    # nobody is interested anymore → stop spending bandwidth on it
+                    self._forget(key, task)
+                    task.cancel()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._tasks), "leaders": self.leaders, "joined": self.joined}
+
+inflight = SingleFlight()
+
+# ─── Restriction classifier (streaming, single pass) ───────────────────────────
+# Heuristics to detect "restricted" on a fragment page, matched in one alternation.
+RESTRICT_MARKERS = (
+    "restricted on Telegram",
+    "This phone number is restricted",
+    "Blocked",
+)
+_RESTRICT_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(m) for m in RESTRICT_MARKERS) + r")\b", re.I
+)
+# carried between chunks so a marker split across a boundary is still found;
+# +1 keeps the char before the marker around for the leading \b check
+_OVERLAP = max(len(m) for m in RESTRICT_MARKERS) + 1
+
+def is_restricted_html(html: str) -> Optional[bool]:
+    """Return True if restricted, False if confidently not, None if unknown/error."""
+    if not html:
+        return None
+    # If page is reachable but no restricted markers found, treat as not restricted
+    return bool(_RESTRICT_RE.search(html))
+
+async def classify_response(
+    resp: aiohttp.ClientResponse,
+    chunk_size: int = CLASSIFY_CHUNK,
+    max_bytes: int = CLASSIFY_MAX_BYTES,
+) -> Optional[bool]:
+    """
+    Stream the body and stop as soon as a verdict is known, instead of
+    buffering and decoding the whole page. Same verdicts as is_restricted_html;
+    a page larger than max_bytes without markers counts as not restricted.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="ignore")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    tail = ""
+    start = 0   # 1 once tail begins with a context-only char (checked by \b, never matched)
+    seen = 0
+    verdict: Optional[bool] = None
+
+    async for chunk in resp.content.iter_chunked(chunk_size):
+        seen += len(chunk)
+        window = tail + decoder.decode(chunk)
+        m = _RESTRICT_RE.search(window, start)
+        # a match touching the window end may still continue ("Blockedness") → wait for more
+        if m and m.end() < len(window):
+            verdict = True
+            break
+        tail = window[-_OVERLAP:]
+        # once trimmed, tail[0] is context; a chunk that decodes to nothing keeps it that way
+        start = 1 if (len(window) > _OVERLAP or start) else 0
+        if seen >= max_bytes:
+            verdict = False
+            break
+    else:
+        if seen == 0:
+            return None
+        window = tail + decoder.decode(b"", final=True)
+        return bool(_RESTRICT_RE.search(window, start))
+
+    await _drain(resp, seen)
+    return verdict
+
+async def _drain(resp: aiohttp.ClientResponse, seen: int) -> None:
+    """Discard a small unread remainder so the keep-alive socket can be reused."""
+    if resp.content.at_eof():
+        return
+    total = resp.content_length
+    if total is None or total - seen > DRAIN_MAX_BYTES:
+        resp.close()  # cheaper to drop the socket than to download the rest
+        return
+    try:
+        while await resp.content.read(CLASSIFY_CHUNK):
+            pass
+    except Exception:
+        resp.close()
+
+# ─── Adaptive concurrency limiter (AIMD) ───────────────────────────────────────
+OK = "ok"
+ERROR = "error"          # network error, no signal about upstream load
+TIMEOUT = "timeout"      # back off
+THROTTLED = "throttled"  # 429 / 5xx → back off
+
+class _Slot:
+    """One acquired unit of concurrency; set .outcome before leaving the block."""
+
+    def __init__(self, limiter: "AdaptiveLimiter"):
+        self.limiter = limiter
+        self.outcome = OK
+        self.started = 0.0
+
+    async def __aenter__(self) -> "_Slot":
+        await self.limiter.acquire()
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        outcome: Optional[str] = self.outcome
+        if exc_type is not None:
+            if issubclass(exc_type, asyncio.CancelledError):
+                outcome = None  # caller gave up, says nothing about upstream
+            elif issubclass(exc_type, asyncio.TimeoutError):
+                outcome = TIMEOUT
+            else:
+                outcome = ERROR
+        self.limiter.release(time.monotonic() - self.started, outcome)
+
+# ─── Fair sharing of limiter slots ─────────────────────────────────────────────
+INTERACTIVE = 0   # inline scans: served before any bulk work
+BULK = 1          # /checkall, CLI batches
+
+Flow = Tuple[int, Hashable]  # (priority class, owner e.g. user id)
+_flow: ContextVar[Flow] = ContextVar("fragment_flow", default=(BULK, None))
+
+def set_flow(priority: int, owner: Hashable) -> None:
+    """Tag fetches started from the current task (and tasks it spawns) with a priority and owner."""
+    _flow.set((priority, owner))
+
+class FairQueue:
+    """
+    Limiter waiters grouped per flow. A lower priority class is always served
+    first; inside a class, flows take turns (deficit round-robin with unit
+    cost, i.e. one slot per flow per round), so a 1000-number batch cannot
+    push another user's requests to the back of one long FIFO line.
+    """
+
+    def __init__(self):
+        self._classes: Dict[int, "OrderedDict[Hashable, Deque[asyncio.Future]]"] = {}
+        self._len = 0
+
+    def push(self, flow: Flow, fut: asyncio.Future) -> None:
+        prio, owner = flow
+        flows = self._classes.setdefault(prio, OrderedDict())
+        q = flows.get(owner)
+        if q is None:
+            q = flows[owner] = deque()
+        q.append(fut)
+        self._len += 1
+
+    def remove(self, flow: Flow, fut: asyncio.Future) -> bool:
+        prio, owner = flow
+        q = self._classes.get(prio, {}).get(owner)
+        if q is None or fut not in q:
+            return False
+        q.remove(fut)
+        self._len -= 1
+        if not q:
+            del self._classes[prio][owner]
+        return True
+
+    def pop(self) -> Optional[asyncio.Future]:
+        for prio in sorted(self._classes):
+            flows = self._classes[prio]
+            while flows:
+                owner, q = next(iter(flows.items()))
+                fut = q.popleft()
+                self._len -= 1
+                if q:
+                    flows.move_to_end(owner)  # next flow's turn
+                else:
+                    del flows[owner]
+                if not fut.done():
+                    return fut
+        return None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            f"{'interactive' if prio == INTERACTIVE else 'bulk'}_flows": len(flows)
+            for prio, flows in self._classes.items()
+        }
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for fragment.com that adapts with AIMD. It starts in slow
+    start (one slot per fast response, so the limit doubles every round trip),
+    then grows by about one slot per window of healthy responses. It halves only
+    when timeouts, 429s and 5xx make up error_rate of the last `window`
+    responses; the window restarts after each decrease, so one burst of
+    errors backs off once and isolated errors never do.
+    """
+
+    def __init__(
+        self,
+        initial: int = CONC_INITIAL,
+        min_limit: int = CONC_MIN,
+        max_limit: int = CONC_MAX,
+        latency_target: float = LATENCY_TARGET,
+        backoff: float = BACKOFF_FACTOR,
+        cooldown: float = BACKOFF_COOLDOWN,
+        window: int = BACKOFF_WINDOW,
+        error_rate: float = BACKOFF_ERROR_RATE,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_use = 0
+        self._granted = 0   # slots handed to woken waiters that have not resumed yet
+        self._waiters = FairQueue()
+        self._last_backoff = 0.0
+        self._slow_start = True
+        self._recent: Deque[bool] = deque(maxlen=max(1, window))  # True = congestion signal, since last decrease
+        self._recent_bad = 0
+        self._bad_limit = max(1, math.ceil(error_rate * max(1, window)))
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self._outcomes: Deque[str] = deque(maxlen=500)
+
+    def slot(self) -> _Slot:
+        return _Slot(self)
+
+    async def acquire(self) -> None:
+        # no barging: while anyone is queued, newcomers queue too, so the order is the fair queue's
+        if self.in_use + self._granted < int(self.limit) and not self._waiters:
+            self.in_use += 1
+            return
+        flow = _flow.get()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.push(flow, fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if not self._waiters.remove(flow, fut) and fut.done() and not fut.cancelled():
+                self._granted -= 1
+                self._wake()  # pass the slot we were given along
+            raise
+        self._granted -= 1
+        self.in_use += 1
+
+    def release(self, latency: float, outcome: Optional[str]) -> None:
+        self.in_use -= 1
+        if outcome is not None:
+            self._record(latency, outcome)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_use - self._granted
+        while free > 0:
+            fut = self._waiters.pop()
+            if fut is None:
+                break
+            fut.set_result(None)
+            self._granted += 1
+            free -= 1
+
+    def _record(self, latency: float, outcome: str) -> None:
+        self._outcomes.append(outcome)
+        bad = outcome in (TIMEOUT, THROTTLED)
+        if len(self._recent) == self._recent.maxlen and self._recent[0]:
+            self._recent_bad -= 1
+        self._recent.append(bad)
+        self._recent_bad += bad
+        if outcome == OK:
+            self._latencies.append(latency)
+            # grow only while the recent error rate is well below the back-off threshold
+            if latency <= self.latency_target and self._recent_bad * 2 < self._bad_limit:
+                step = 1.0 if self._slow_start else 1.0 / self.limit
+                self.limit = min(self.max_limit, self.limit + step)
+        elif bad and self._recent_bad >= self._bad_limit:
+            now = time.monotonic()
+            if now - self._last_backoff >= self.cooldown:
+                self._last_backoff = now
+                self._slow_start = False
+                self._recent.clear()  # judge the new limit on responses sent under it
+                self._recent_bad = 0
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                logger.info(f"fragment limiter backing off ({outcome}) → limit={int(self.limit)}")
+
+    def percentiles(self, qs: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> Dict[str, float]:
+        data: List[float] = sorted(self._latencies)
+        if not data:
+            return {f"p{int(q * 100)}": 0.0 for q in qs}
+        return {f"p{int(q * 100)}": data[min(len(data) - 1, int(q * len(data)))] for q in qs}
+
+    def timeout_for(self, cap: float) -> float:
+        """Per-request timeout: a few times the recent p99, never above the caller's cap."""
+        if len(self._latencies) < 20:
+            return cap
+        return min(cap, max(MIN_TIMEOUT, self.percentiles((0.99,))["p99"] * 3))
+
+    def stats(self) -> Dict[str, float]:
+        n = len(self._outcomes)
+        bad = sum(1 for o in self._outcomes if o != OK)
+        out: Dict[str, float] = {
+            "limit": int(self.limit),
+            "in_use": self.in_use,
+            "queued": len(self._waiters),
+            "error_rate": (bad / n) if n else 0.0,
+        }
+        out.update(self._waiters.stats())
+        out.update(self.percentiles())
+        return out
+
+limiter = AdaptiveLimiter()
+
+# ─── Retries with jittered backoff + hedged requests ────────────────────────────
+Attempt = Callable[[float], Awaitable[Optional[bool]]]
+
+_hedge_counts = {"attempts": 0, "hedges": 0, "hedge_wins": 0, "retries": 0}
+
+async def _guarded(attempt: Attempt, timeout: float) -> Optional[bool]:
+    try:
+        return await attempt(timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.debug(f"fragment attempt failed: {e!r}")
+        return None
+
+def _hedge_delay() -> Optional[float]:
+    if not HEDGE_ENABLED or len(limiter._latencies) < 20:
+        return None
+    if _hedge_counts["hedges"] >= HEDGE_MAX_RATIO * max(1, _hedge_counts["attempts"]):
+        return None
+    if limiter.in_use >= int(limiter.limit):
+        return None  # a hedge would only queue behind the limiter
+    q = HEDGE_PERCENTILE
+    return limiter.percentiles((q,))[f"p{int(q * 100)}"]
+
+async def _hedged(attempt: Attempt, timeout: float) -> Optional[bool]:
+    """Run one attempt; if it is slower than the hedge threshold, race a second copy."""
+    _hedge_counts["attempts"] += 1
+    delay = _hedge_delay()
+    if delay is None or delay >= timeout:
+        return await _guarded(attempt, timeout)
+
+    first = asyncio.ensure_future(_guarded(attempt, timeout))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        _hedge_counts["hedges"] += 1
+        second = asyncio.ensure_future(_guarded(attempt, timeout - delay))
+        pending.add(second)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                res = t.result()
+                if res is not None:
+                    if t is second:
+                        _hedge_counts["hedge_wins"] += 1
+                    return res
+        return None
+    finally:
+        for t in pending:
+            t.cancel()
+
+async def with_retries(
+    attempt: Attempt,
+    per_attempt: float,
+    budget: float = RETRY_BUDGET,
+    attempts: int = RETRY_ATTEMPTS,
+) -> Optional[bool]:
+    """
+    Call attempt(timeout) until it yields a definite verdict. Each try gets its
+    own deadline, waits between tries use capped full-jitter backoff, and the
+    whole thing never runs past budget seconds, time spent queueing for a
+    limiter slot included. None means every try failed.
+    """
+    deadline = time.monotonic() + budget
+    for i in range(max(1, attempts)):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0.05:
+            break
+        try:
+            # the request timeout only starts once a slot is held; this also bounds the wait for it
+            res = await asyncio.wait_for(_hedged(attempt, min(per_attempt, remaining)), remaining)
+        except asyncio.TimeoutError:
+            break
+        if res is not None:
+            return res
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** i)))
+        if i + 1 >= attempts or time.monotonic() + delay >= deadline:
+            break
+        _hedge_counts["retries"] += 1
+        await asyncio.sleep(delay)
+    return None
+
+def retry_stats() -> Dict[str, int]:
+    return dict(_hedge_counts)
+
+# ─── Unified checker engine ────────────────────────────────────────────────────
+def canonical(tok: str) -> str:
+    """Keep digits only."""
+    return re.sub(r"\D", "", (tok or ""))
+
+_FETCH_SECONDS = metrics.histogram("fragment_fetch_seconds", "Latency of single fragment.com requests")
+_SLOT_WAIT_SECONDS = metrics.histogram("fragment_slot_wait_seconds", "Time queued for a limiter slot before a request")
+_FETCH_TOTAL = metrics.counter("fragment_fetch_total", "fragment.com requests by outcome / error class")
+_RESULTS_TOTAL = metrics.counter("fragment_results_total", "Fetched verdicts (cache misses) by status")
+
+class FragmentChecker:
+    """
+    The one fetch-and-classify pipeline every handler and offline tool goes
+    through: status cache → single-flight → limiter + retries/hedging →
+    streaming classifier, all over the shared pooled session.
+    """
+
+    def __init__(
+        self,
+        timeout: float = CHECK_TIMEOUT,
+        budget: float = RETRY_BUDGET,
+        window: int = BATCH_WINDOW,
+        base_url: str = "https://fragment.com",
+        workers: int = 0,
+    ):
+        self.timeout = timeout
+        self.budget = budget
+        self.window = max(1, window)
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers  # >0 forces process sharding; 0 follows FRAGMENT_WORKERS
+
+    async def _attempt(self, num: str, timeout: float) -> Optional[bool]:
+        url = f"{self.base_url}/phone/{num}"
+        outcome = ERROR
+        queued = time.perf_counter()
+        t0: Optional[float] = None
+        try:
+            async with limiter.slot() as slot:
+                t0 = time.perf_counter()  # request latency excludes the queue; that is its own histogram
+                _SLOT_WAIT_SECONDS.observe(t0 - queued)
+                async with get_session().get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        slot.outcome = THROTTLED
+                        outcome = f"http_{resp.status}"
+                        return None
+                    res = await classify_response(resp)
+                    outcome = OK
+                    return res
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            outcome = TIMEOUT
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if t0 is not None:  # never got a slot → no request was made
+                _FETCH_SECONDS.observe(time.perf_counter() - t0)
+                _FETCH_TOTAL.inc(outcome=outcome)
+
+    async def _fetch(self, num: str, timeout: float, budget: float) -> Optional[bool]:
+        per_attempt = limiter.timeout_for(timeout)
+        res = await with_retries(lambda t: self._attempt(num, t), per_attempt, budget)
+        if res is None:
+            logger.warning(f"Fetch failed for {num}: no verdict after retries")
+        _RESULTS_TOTAL.inc(status="unknown" if res is None else ("restricted" if res else "free"))
+        status_cache.put(num, res)
+        return res
+
+    async def check(
+        self, num: str, timeout: Optional[float] = None, budget: Optional[float] = None
+    ) -> Tuple[str, Optional[bool]]:
+        """
+        Returns (num, restricted):
+          True  → restricted
+          False → not restricted
+          None  → error / unknown
+        """
+        hit, cached = status_cache.get(num)
+        if hit:
+            return num, cached
+        return await self._lookup(num, timeout, budget)
+
+    async def _lookup(
+        self, num: str, timeout: Optional[float], budget: Optional[float]
+    ) -> Tuple[str, Optional[bool]]:
+        t = self.timeout if timeout is None else timeout
+        b = self.budget if budget is None else budget
+        # identical numbers checked concurrently (other users, inline) share one GET
+        return num, await inflight.run(num, lambda: self._fetch(num, t, b))
+
+    async def check_many(
+        self,
+        numbers: Iterable[str],
+        timeout: Optional[float] = None,
+        budget: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[str, Optional[bool]]]:
+        """
+        Yield (num, restricted) in completion order. Numbers are canonicalized
+        and deduplicated; cache hits come out first without spawning tasks, and at
+        most `window` fetches exist at once so huge batches stay cheap. Closing or
+        cancelling the iterator cancels whatever is still pending. Large batches
+        go to the process pool (fragment_pool) when it is enabled.
+        """
+        seen: Set[str] = set()
+        todo: List[str] = []
+        for tok in numbers:
+            num = canonical(tok)
+            if not num or num in seen:
+                continue
+            seen.add(num)
+            hit, cached = status_cache.get(num)
+            if hit:
+                yield num, cached
+            else:
+                todo.append(num)
+
+        import fragment_pool  # imported lazily: fragment_pool imports this module
+        if fragment_pool.enabled_for(len(todo), self.workers):
+            sharded = fragment_pool.check_sharded(
+                todo,
+                self.timeout if timeout is None else timeout,
+                self.budget if budget is None else budget,
+                self.base_url,
+                self.workers,
+            )
+            try:
+                async for res in sharded:
+                    yield res
+            finally:
+                await sharded.aclose()
+            return
+
+        it = iter(todo)
+        pending: Set[asyncio.Future] = set()
+        try:
+            while True:
+                for num in it:
+                    pending.add(asyncio.ensure_future(self._lookup(num, timeout, budget)))
+                    if len(pending) >= self.window:
+                        break
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        finally:
+            for fut in pending:
+                fut.cancel()  # abandoned numbers stop using bandwidth
+
+    async def check_list(self, numbers: Iterable[str], **kw) -> List[Tuple[str, Optional[bool]]]:
+        """Convenience: run check_many to completion, results sorted by number."""
+        return sorted([r async for r in self.check_many(numbers, **kw)])
+
+checker = FragmentChecker()
+
+metrics.register_gauges("fragment_cache", lambda: status_cache.stats())
+metrics.register_gauges("fragment_limiter", lambda: limiter.stats())
+metrics.register_gauges("fragment_inflight", lambda: inflight.stats())
+metrics.register_gauges("fragment_retry", retry_stats)
@@ -0,0 +1,134 @@
+# fragment_pool.py — optional multi-process sharding for very large batches
+import os
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+import fragment_client
+
+logger = logging.getLogger(__name__)
+
+PROCESS_WORKERS = int(os.getenv("FRAGMENT_WORKERS", "0"))        # 0 = single-process (default)
+SHARD_SIZE      = int(os.getenv("FRAGMENT_SHARD_SIZE", "250"))    # numbers per task sent to a worker
+SHARD_MIN_BATCH = int(os.getenv("FRAGMENT_SHARD_MIN", "1000"))    # smaller batches stay in-process
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_warned_late = False
+
+# ─── Worker side ───────────────────────────────────────────────────────────────
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _init_worker(conc_max: int) -> None:
+    """
+    Runs once in each worker. Forked children inherit the parent's session,
+    limiter and caches bound to the parent's loop, so start them fresh; the
+    loop lives as long as the worker so its keep-alive pool is reused across shards.
+    """
+    global _worker_loop, PROCESS_WORKERS
+    PROCESS_WORKERS = 0  # a worker never shards again
+    fragment_client._session = None
+    fragment_client.status_cache = fragment_client.StatusCache()
+    fragment_client.inflight = fragment_client.SingleFlight()
+    fragment_client.limiter = fragment_client.AdaptiveLimiter(
+        initial=min(fragment_client.CONC_INITIAL, conc_max), max_limit=conc_max
+    )
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    Finalize(None, _close_worker, exitpriority=10)
+
+def _close_worker() -> None:
+    if _worker_loop is not None and not _worker_loop.is_closed():
+        _worker_loop.run_until_complete(fragment_client.close_session())
+        _worker_loop.close()
+
+def _check_shard(
+    nums: List[str], timeout: float, budget: float, base_url: str
+) -> List[Tuple[str, Optional[bool]]]:
+    checker = fragment_client.FragmentChecker(timeout=timeout, budget=budget, base_url=base_url)
+    return _worker_loop.run_until_complete(checker.check_list(nums))
+
+# ─── Parent side ───────────────────────────────────────────────────────────────
+def _resolve(workers: int) -> int:
+    return workers or PROCESS_WORKERS or (os.cpu_count() or 1)
+
+def _share(workers: int) -> int:
+    """Connections each process may use: CONC_MAX split between the parent and its workers."""
+    return max(fragment_client.CONC_MIN, fragment_client.CONC_MAX // (workers + 1))
+
+def start(workers: int = 0) -> ProcessPoolExecutor:
+    """
+    Create the pool and fork all its workers now. fork copies only the calling
+    thread, so this has to run at startup, before any executor, watchdog or
+    resolver thread exists. The parent's own limiter is cut to the same share,
+    so parent and workers together stay within CONC_MAX connections.
+    """
+    global _pool, _pool_workers
+    workers = _resolve(workers)
+    if _pool is not None and _pool_workers == workers:
+        return _pool
+    shutdown()
+    # fork: spawn/forkserver would re-import bot.py as __main__ in every worker
+    ctx = multiprocessing.get_context("fork")
+    share = _share(workers)
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(share,))
+    _pool.submit(int).result()  # with fork every worker is launched on the first submit
+    _pool_workers = workers
+    fragment_client.limiter = fragment_client.AdaptiveLimiter(
+        initial=min(fragment_client.CONC_INITIAL, share), max_limit=share
+    )
+    logger.info(f"fragment process pool started ({workers} workers + parent, {share} conns each)")
+    return _pool
+
+def get_pool(workers: int = 0) -> ProcessPoolExecutor:
+    if _pool is None or _pool_workers != _resolve(workers):
+        raise RuntimeError("fragment process pool not started; call fragment_pool.start() at startup")
+    return _pool
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+def enabled_for(n: int, workers: int = 0) -> bool:
+    global _warned_late
+    workers = workers or PROCESS_WORKERS
+    if workers <= 0 or n < SHARD_MIN_BATCH:
+        return False
+    if _pool is not None and _pool_workers == workers:
+        return True
+    if not _warned_late:
+        _warned_late = True
+        logger.warning("fragment process pool was not started at startup (fragment_pool.start); checking in-process")
+    return False
+
+async def check_sharded(
+    nums: List[str],
+    timeout: float,
+    budget: float,
+    base_url: str,
+    workers: int = 0,
+) -> AsyncIterator[Tuple[str, Optional[bool]]]:
+    """
+    Split nums into shards, check them across worker processes (each with its
+    own loop and connection pool) and yield results shard by shard in input
+    order. Results are written back to this process's status cache.
+    """
+    pool = get_pool(workers)
+    loop = asyncio.get_running_loop()
+    futs = [
+        loop.run_in_executor(pool, _check_shard, nums[i : i + SHARD_SIZE], timeout, budget, base_url)
+        for i in range(0, len(nums), SHARD_SIZE)
+    ]
+    try:
+        for fut in futs:
+            for num, ok in await fut:
+                fragment_client.status_cache.put(num, ok)
+                yield num, ok
+    finally:
+        for fut in futs:
+            fut.cancel()  # shards not yet started are dropped
@@ -0,0 +1,172 @@
+# metrics.py — tiny in-process metrics registry (counters, histograms, gauges)
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        k = _key(labels)
+        self.values[k] = self.values.get(k, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_fmt_labels(k)} {v:g}" for k, v in self.values.items()]
+        return out
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are interpolated from buckets."""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[LabelKey, List[int]] = {}
+        self.sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        k = _key(labels)
+        counts = self.counts.get(k)
+        if counts is None:
+            counts = self.counts[k] = [0] * (len(self.buckets) + 1)  # last slot = +Inf
+            self.sums[k] = 0.0
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self.sums[k] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Works around both sync calls and awaits: `with h.time(): await x()`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def quantile(self, q: float, key: LabelKey = ()) -> float:
+        counts = self.counts.get(key)
+        if not counts:
+            return 0.0
+        total = sum(counts)
+        target = q * total
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if c and seen + c >= target:
+                return lower + (upper - lower) * ((target - seen) / c)
+            seen += c
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, counts in self.counts.items():
+            acc = 0
+            for i, b in enumerate(self.buckets):
+                acc += counts[i]
+                out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', f'{b:g}'))} {acc}")
+            acc += counts[-1]
+            out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {self.sums[k]:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {acc}")
+        return out
+
+# ─── Registry ──────────────────────────────────────────────────────────────────
+_metrics: Dict[str, object] = {}
+_gauges: Dict[str, Callable[[], Dict[str, float]]] = {}  # prefix → callback
+
+def counter(name: str, help: str = "") -> Counter:
+    m = _metrics.get(name)
+    if m is None:
+        m = _metrics[name] = Counter(name, help)
+    return m  # type: ignore[return-value]
+
+def histogram(name: str, help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    m = _metrics.get(name)
+    if m is None:
+        m = _metrics[name] = Histogram(name, help, buckets)
+    return m  # type: ignore[return-value]
+
+def register_gauges(prefix: str, fn: Callable[[], Dict[str, float]]) -> None:
+    """fn() is read on every scrape / /stats; each key becomes gauge prefix_key."""
+    _gauges[prefix] = fn
+
+def _read_gauges() -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for prefix, fn in _gauges.items():
+        try:
+            for k, v in fn().items():
+                out[f"{prefix}_{k}"] = float(v)
+        except Exception as e:
+            logger.debug(f"gauge {prefix} failed: {e!r}")
+    return out
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for m in _metrics.values():
+        lines += m.render()  # type: ignore[attr-defined]
+    for name, v in _read_gauges().items():
+        lines += [f"# TYPE {name} gauge", f"{name} {v:g}"]
+    return "\n".join(lines) + "\n"
+
+def summary() -> List[str]:
+    """Human-readable lines for the /stats command."""
+    lines: List[str] = []
+    for m in _metrics.values():
+        if isinstance(m, Histogram):
+            for k, counts in sorted(m.counts.items()):
+                n = sum(counts)
+                label = ",".join(v for _, v in k) or "-"
+                lines.append(
+                    f"{m.name}[{label}] n={n} avg={m.sums[k] / n * 1000:.0f}ms "
+                    f"p50={m.quantile(0.5, k) * 1000:.0f}ms p95={m.quantile(0.95, k) * 1000:.0f}ms "
+                    f"p99={m.quantile(0.99, k) * 1000:.0f}ms"
+                )
+        elif isinstance(m, Counter):
+            for k, v in sorted(m.values.items()):
+                label = ",".join(v for _, v in k) or "-"
+                lines.append(f"{m.name}[{label}] {v:g}")
+    for name, v in _read_gauges().items():
+        lines.append(f"{name} {v:g}")
+    return lines
+
+# ─── Optional Prometheus endpoint ──────────────────────────────────────────────
+async def start_http(port: int, host: str = "127.0.0.1"):
+    """Serve GET /metrics in Prometheus text format; returns the runner to clean up."""
+    from aiohttp import web
+
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"metrics on http://{host}:{port}/metrics")
+    return runner
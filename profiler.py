@@ -0,0 +1,309 @@
+# profiler.py — on-demand profiling (/profile) and an event-loop lag watchdog
+#
+#   /profile                 cProfile for PROFILE_DEFAULT_SECONDS
+#   /profile 200             cProfile for the next 200 updates
+#   /profile sample 30s      stack sampling for 30 seconds (low overhead)
+#   /profile stop            finish early and send what was collected
+#
+# The watchdog thread notices when the loop has not ticked for LOOP_LAG_MS and
+# logs the loop thread's stack together with the task it was running (handler
+# name, or the coroutine for untracked work such as chat workers), so blocking
+# calls (check_output, big json.dumps, …) show up with their culprit.
+import sys
+import os
+import re
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import threading
+import traceback
+from io import StringIO
+from collections import Counter as _Tally
+from typing import Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.filters import Command
+from aiogram.types import BufferedInputFile, Message
+
+import metrics
+
+_main = sys.modules["__main__"]
+dp = _main.dp
+bot = _main.bot
+is_admin = _main.is_admin
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DEFAULT_SECONDS = int(os.getenv("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS     = int(os.getenv("PROFILE_MAX_SECONDS", "600"))   # hard cap, also for update counts
+PROFILE_TOP             = int(os.getenv("PROFILE_TOP", "40"))            # rows per table in the report
+SAMPLE_INTERVAL         = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+LOOP_LAG_MS             = float(os.getenv("LOOP_LAG_MS", "250"))          # 0 disables the watchdog
+LOOP_LAG_INTERVAL       = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+
+_LOOP_LAG = metrics.histogram(
+    "loop_lag_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+_STALLS = metrics.counter("loop_stalls_total", "Loop stalls above LOOP_LAG_MS by handler")
+
+# ─── Which handler is running ──────────────────────────────────────────────────
+_active: Dict[int, str] = {}  # id(task) → handler name
+
+def task_name(task: Optional[asyncio.Task]) -> str:
+    """Handler name for a tracked task, else its coroutine (chat workers, background jobs)."""
+    if task is None:
+        return "(callback)"  # the loop was running a plain callback, not a task
+    name = _active.get(id(task))
+    if name:
+        return name
+    return getattr(task.get_coro(), "__qualname__", None) or task.get_name()
+
+class _HandlerTracker(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        h = data.get("handler")
+        task = asyncio.current_task()
+        key = id(task)
+        _active[key] = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        try:
+            return await handler(event, data)
+        finally:
+            _active.pop(key, None)
+
+# ─── Sampling profiler ─────────────────────────────────────────────────────────
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return code.co_name == "select" and code.co_filename.endswith("selectors.py")
+
+class _Sampler(threading.Thread):
+    """Periodically snapshots one thread's Python stack; no tracing overhead in that thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self.own: _Tally = _Tally()
+        self.total: _Tally = _Tally()
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            if _is_idle(frame):
+                self.idle += 1
+                continue
+            self.own[_frame_key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(_frame_key(frame))
+                frame = frame.f_back
+            self.total.update(seen)
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+        self.join()
+
+    def report(self, top: int) -> str:
+        busy = max(1, self.samples - self.idle)
+        out = [
+            f"{self.samples} samples every {self.interval * 1000:g} ms, "
+            f"{self.idle} idle in select ({self.idle * 100 / max(1, self.samples):.1f}%)",
+            "",
+            f"{'self%':>7} {'samples':>8}  function (by own time)",
+        ]
+        out += [f"{n * 100 / busy:7.1f} {n:8d}  {k}" for k, n in self.own.most_common(top)]
+        out += ["", f"{'incl%':>7} {'samples':>8}  function (including callees)"]
+        out += [f"{n * 100 / busy:7.1f} {n:8d}  {k}" for k, n in self.total.most_common(top)]
+        return "\n".join(out) + "\n"
+
+# ─── Profiling session ─────────────────────────────────────────────────────────
+class _Session:
+    def __init__(self, mode: str, chat_id: int, updates: int, seconds: float):
+        self.mode = mode
+        self.chat_id = chat_id
+        self.updates_left = updates      # 0 → time-bound only
+        self.updates_seen = 0
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.prof: Optional[cProfile.Profile] = None
+        self.sampler: Optional[_Sampler] = None
+        self.timer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.mode == "sample":
+            self.sampler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL)
+            self.sampler.start()
+        else:
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+
+    def stop(self) -> str:
+        elapsed = time.monotonic() - self.started
+        head = (
+            f"mode={self.mode} elapsed={elapsed:.1f}s updates={self.updates_seen}\n"
+            f"loop thread only; work in executor threads is not included\n\n"
+        )
+        if self.sampler is not None:
+            self.sampler.stop()
+            return head + self.sampler.report(PROFILE_TOP)
+        self.prof.disable()
+        buf = StringIO()
+        st = pstats.Stats(self.prof, stream=buf).strip_dirs()
+        buf.write("── by cumulative time ──\n")
+        st.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        buf.write("── by own time ──\n")
+        st.sort_stats("tottime").print_stats(PROFILE_TOP)
+        return head + buf.getvalue()
+
+_session: Optional[_Session] = None
+
+async def _finish(reason: str) -> None:
+    global _session
+    s, _session = _session, None
+    if s is None:
+        return
+    if s.timer is not None and s.timer is not asyncio.current_task():
+        s.timer.cancel()
+    report = s.stop()
+    name = f"profile-{s.mode}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+    try:
+        await bot.send_document(
+            s.chat_id,
+            BufferedInputFile(report.encode(), filename=name),
+            caption=f"🔬 Profile finished ({reason}), {s.updates_seen} updates",
+        )
+    except Exception as e:
+        logger.warning(f"Failed to send profile report: {e}")
+
+async def _stop_after(seconds: float) -> None:
+    await asyncio.sleep(seconds)
+    await _finish(f"{seconds:g}s elapsed")
+
+class _UpdateCounter(BaseMiddleware):
+    """Outer update middleware: ends an update-bound session once N updates were handled."""
+
+    async def __call__(self, handler, event, data):
+        s = _session
+        try:
+            return await handler(event, data)
+        finally:
+            if s is not None and s is _session:
+                s.updates_seen += 1
+                if s.updates_left and s.updates_seen >= s.updates_left:
+                    asyncio.create_task(_finish(f"{s.updates_seen} updates"))
+
+dp.update.outer_middleware(_UpdateCounter())
+dp.message.middleware(_HandlerTracker())
+dp.inline_query.middleware(_HandlerTracker())
+
+_USAGE = (
+    "Usage: <code>/profile [cpu|sample] [N | Ns]</code>\n"
+    "N = next N updates, Ns = for N seconds; <code>/profile stop</code> ends early."
+)
+
+@dp.message(Command("profile"))
+async def profile_handler(message: Message):
+    global _session
+    if not is_admin(message):
+        return
+    args = (message.text or "").split()[1:]
+    if args and args[0].lower() == "stop":
+        if _session is None:
+            return await message.reply("No profile is running.")
+        return await _finish("stopped")
+    if _session is not None:
+        return await message.reply("⚠️ A profile is already running; <code>/profile stop</code> first.", parse_mode="HTML")
+
+    mode, updates, seconds = "cpu", 0, float(PROFILE_DEFAULT_SECONDS)
+    for a in args:
+        a = a.lower()
+        if a in ("cpu", "sample"):
+            mode = a
+        elif re.fullmatch(r"\d+s", a):
+            seconds = float(a[:-1])
+        elif a.isdigit():
+            updates = int(a)
+            seconds = float(PROFILE_MAX_SECONDS)
+        else:
+            return await message.reply(_USAGE, parse_mode="HTML")
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+
+    # the reply is sent before profiling starts so it does not count as one of the N updates
+    scope = f"next {updates} updates (max {seconds:g}s)" if updates else f"{seconds:g}s"
+    await message.reply(f"🔬 Profiling ({mode}) for {scope}…")
+    s = _Session(mode, message.chat.id, updates, seconds)
+    s.start()
+    s.timer = asyncio.create_task(_stop_after(seconds))
+    _session = s
+
+# ─── Event-loop lag watchdog ───────────────────────────────────────────────────
+_beat = 0.0                   # monotonic time of the last loop tick
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[int] = None
+_stall_culprit: Optional[str] = None
+_lag_task: Optional[asyncio.Task] = None
+_watchdog_stop = threading.Event()
+
+def _watchdog() -> None:
+    """Runs in its own thread: catches the loop while it is still blocked."""
+    global _stall_culprit
+    threshold = LOOP_LAG_INTERVAL + LOOP_LAG_MS / 1000
+    reported = 0.0
+    while not _watchdog_stop.wait(LOOP_LAG_INTERVAL):
+        beat = _beat
+        overdue = time.monotonic() - beat
+        if overdue <= LOOP_LAG_INTERVAL:
+            continue
+        # the loop is late: whatever task it is running right now is what blocks it
+        _stall_culprit = task_name(asyncio.current_task(_loop))
+        if beat == reported or overdue < threshold:
+            continue
+        reported = beat
+        frame = sys._current_frames().get(_loop_thread)
+        stack = "".join(traceback.format_stack(frame, limit=12)) if frame is not None else "(no frame)"
+        logger.warning(f"event loop blocked >{LOOP_LAG_MS:g} ms in [{_stall_culprit}]:\n{stack}")
+
+async def _lag_monitor() -> None:
+    global _beat, _stall_culprit
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        _beat = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - t0 - LOOP_LAG_INTERVAL)
+        culprit, _stall_culprit = _stall_culprit or "unknown", None  # seen by the watchdog during this tick
+        _LOOP_LAG.observe(lag)
+        if lag * 1000 >= LOOP_LAG_MS:
+            _STALLS.inc(handler=culprit)
+            logger.warning(f"event loop stalled {lag * 1000:.0f} ms in [{culprit}]")
+
+@dp.startup()
+async def _start_lag_monitor():
+    global _lag_task, _loop, _loop_thread, _beat
+    if LOOP_LAG_MS <= 0:
+        return
+    _loop = asyncio.get_running_loop()
+    _loop_thread = threading.get_ident()
+    _beat = time.monotonic()
+    _lag_task = asyncio.create_task(_lag_monitor())
+    _watchdog_stop.clear()
+    threading.Thread(target=_watchdog, name="loop-watchdog", daemon=True).start()
+
+@dp.shutdown()
+async def _stop_lag_monitor():
+    _watchdog_stop.set()
+    if _lag_task is not None:
+        _lag_task.cancel()
+    if _session is not None:
+        await _finish("shutdown")
@@ -0,0 +1,86 @@
+# reply_format.py — post-processing of AI replies (normalization, emoji rules, safe splitting)
+import re
+import html
+from typing import List
+
+TELEGRAM_LIMIT = 4096
+
+# Same code point ranges the bot has always treated as emoji.
+_EMOJI_RANGES = (
+    (0x1F300, 0x1F5FF),   # symbols & pictographs
+    (0x1F600, 0x1F64F),   # emoticons
+    (0x1F680, 0x1F6FF),   # transport & map
+    (0x1F700, 0x1F77F),
+    (0x1F780, 0x1F7FF),
+    (0x1F800, 0x1F8FF),
+    (0x1F900, 0x1F9FF),   # supplemental symbols & pictographs
+    (0x1FA00, 0x1FAFF),
+    (0x2600, 0x26FF),     # misc symbols
+    (0x2700, 0x27BF),     # dingbats
+    (0xFE00, 0xFE0F),     # variation selectors
+    (0x1F1E6, 0x1F1FF),   # flags
+    (0x20E3, 0x20E3),     # keycap
+)
+_EMOJI_RE = re.compile("[" + "".join(f"{chr(lo)}-{chr(hi)}" for lo, hi in _EMOJI_RANGES) + "]")
+
+# One pass over the whole reply: per line, drop surrounding blanks and turn
+# '## heading' / '* item' / '- item' into '• …' (a bullet needs a plain space after it).
+_LINE_RE = re.compile(r"^[^\S\n]*(?:(#{2,}|[*-] [^\S\n]*(?=\S))[^\S\n]*)?|[^\S\n]+$", re.M)
+_NEWLINES_RE = re.compile(r"\r\n?|[\v\f\x1c-\x1e\x85\u2028\u2029]")  # what str.splitlines() also breaks on
+
+def is_emoji(ch: str) -> bool:
+    return _EMOJI_RE.match(ch) is not None
+
+def _line_repl(m: "re.Match") -> str:
+    return "• " if m.group(1) else ""
+
+def normalize(text: str) -> str:
+    text = _NEWLINES_RE.sub("\n", text or "")
+    return _LINE_RE.sub(_line_repl, text).strip()
+
+def limit_emojis(text: str, max_emojis: int) -> str:
+    """Keep the first max_emojis emoji code points, drop the rest (0 strips all)."""
+    if max_emojis <= 0:
+        return _EMOJI_RE.sub("", text)
+    seen = 0
+
+    def repl(m: "re.Match") -> str:
+        nonlocal seen
+        seen += 1
+        return m.group(0) if seen <= max_emojis else ""
+
+    return _EMOJI_RE.sub(repl, text)
+
+def format_reply(text: str, allow_emojis: bool, max_emojis: int = 2) -> str:
+    return limit_emojis(normalize(text), max_emojis if allow_emojis else 0).strip()
+
+def split_html(text: str, limit: int = TELEGRAM_LIMIT) -> List[str]:
+    """
+    HTML-escape text into chunks of at most limit characters each. Cuts are
+    made in the raw text, at a paragraph, line or word break when one is
+    reasonably close, so an entity like &amp; is never split.
+    """
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return [escaped] if escaped else []
+    chunks: List[str] = []
+    pos, n = 0, len(text)
+    while pos < n:
+        end = min(n, pos + limit)
+        piece = html.escape(text[pos:end])
+        while len(piece) > limit:  # escaping grew it; shrink in proportion to the overshoot
+            end = pos + min(end - pos - 1, (end - pos) * limit // len(piece))
+            piece = html.escape(text[pos:end])
+        if end < n:
+            window = text[pos:end]
+            for sep in ("\n\n", "\n", " "):
+                cut = window.rfind(sep)
+                if cut > len(window) // 2:
+                    end = pos + cut + len(sep)
+                    piece = html.escape(text[pos:end])
+                    break
+        piece = piece.strip()
+        if piece:
+            chunks.append(piece)
+        pos = end
+    return chunks
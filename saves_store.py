@@ -0,0 +1,182 @@
+# saves_store.py
+import os
+import re
+import json
+import heapq
+import asyncio
+import logging
+import sqlite3
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_DIGITS = 18  # anything longer does not fit an int64
+
+RANGE_MIN_DIGITS = 7  # a shorter 'a-b' is one dashed number ('+888-0123…'), not a range
+
+_RANGE_RE = re.compile(r"\+?(\d+)-\+?(\d+)")
+
+class RangeError(ValueError):
+    """A token written as a range that cannot be expanded."""
+
+def parse_range(tok: str) -> Optional[Tuple[int, int]]:
+    """
+    '888000100-888000999' or short form '888000100-999' → (lo, hi). Returns
+    None when tok is not a range: the end must be as long as the start or a
+    shorter suffix of it. Raises RangeError for a descending or overlong range.
+    """
+    m = _RANGE_RE.fullmatch(tok)
+    if not m:
+        return None
+    lo_s, hi_s = m.groups()
+    if len(lo_s) < RANGE_MIN_DIGITS or len(hi_s) > len(lo_s):
+        return None
+    if len(lo_s) > MAX_DIGITS:
+        raise RangeError(f"{tok}: numbers have at most {MAX_DIGITS} digits")
+    hi_s = lo_s[: len(lo_s) - len(hi_s)] + hi_s
+    lo, hi = int(lo_s), int(hi_s)
+    if lo > hi:
+        raise RangeError(f"{tok}: the range ends before it starts")
+    return lo, hi
+
+# ─── Compact per-user number set ───────────────────────────────────────────────
+class NumberSet:
+    """
+    Saved numbers of one user as a sorted int64 array: 8 bytes per number,
+    O(log n) membership via bisect, ordered iteration for free. Bulk adds
+    merge in one O(n + m) pass instead of inserting one by one.
+    """
+
+    __slots__ = ("_a",)
+
+    def __init__(self, nums: Iterable[int] = ()):
+        self._a = array("q", sorted(set(nums)))
+
+    def __len__(self) -> int:
+        return len(self._a)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._a)
+
+    def __contains__(self, num: int) -> bool:
+        i = bisect_left(self._a, num)
+        return i < len(self._a) and self._a[i] == num
+
+    def count_range(self, lo: int, hi: int) -> int:
+        """How many of [lo, hi] are already in the set."""
+        return bisect_right(self._a, hi) - bisect_left(self._a, lo)
+
+    def add_many(self, nums: Iterable[int], limit: int) -> List[int]:
+        """Add nums (any order) until the set holds limit entries; returns what was new."""
+        room = limit - len(self._a)
+        new: List[int] = []
+        if room <= 0:
+            return new
+        seen = set()
+        for n in nums:
+            if n in seen or n in self:
+                continue
+            seen.add(n)
+            new.append(n)
+            if len(new) >= room:
+                break
+        if new:
+            new.sort()
+            self._a = array("q", heapq.merge(self._a, new))
+        return new
+
+    def add_range(self, lo: int, hi: int, limit: int) -> List[int]:
+        """Add every number in [lo, hi] without building strings; capped at limit."""
+        return self.add_many(range(lo, hi + 1), limit)
+
+    def as_strings(self) -> List[str]:
+        return [str(n) for n in self._a]
+
+# ─── SQLite persistence ────────────────────────────────────────────────────────
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS saved_numbers (
+    user_id INTEGER NOT NULL,
+    num     INTEGER NOT NULL,
+    PRIMARY KEY (user_id, num)
+) WITHOUT ROWID
+"""
+
+class SavesStore:
+    """
+    Saved numbers in SQLite (WAL mode). Every change touches only the rows it
+    adds or removes, and runs on a single background thread so the event loop
+    never waits on disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # crash-safe in WAL; only fsyncs on checkpoint
+        self._conn.execute(_SCHEMA)
+        # one writer thread → writes stay ordered and sqlite3 is never shared across threads at once
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="saves-db")
+
+    # ─── sync (startup / worker thread) ────────────────────────────────────────
+    def load_all(self) -> Dict[int, NumberSet]:
+        grouped: Dict[int, List[int]] = {}
+        for uid, num in self._conn.execute("SELECT user_id, num FROM saved_numbers"):
+            grouped.setdefault(int(uid), []).append(num)
+        return {uid: NumberSet(nums) for uid, nums in grouped.items()}
+
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM saved_numbers LIMIT 1").fetchone() is None
+
+    def _add(self, uid: int, nums: List[int]) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO saved_numbers (user_id, num) VALUES (?, ?)",
+                ((uid, n) for n in nums),
+            )
+
+    def _clear(self, uid: int) -> None:
+        self._conn.execute("DELETE FROM saved_numbers WHERE user_id = ?", (uid,))
+
+    def import_json(self, json_path: str) -> int:
+        """One-time migration from the old saves.json; returns rows imported."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        total = 0
+        for k, v in data.items():
+            nums = [int(n) for n in map(str, v) if n.isdigit() and len(n) <= MAX_DIGITS]
+            self._add(int(k), nums)
+            total += len(nums)
+        return total
+
+    # ─── async (handlers) ──────────────────────────────────────────────────────
+    async def _run(self, fn, *args) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, fn, *args)
+
+    async def add(self, uid: int, nums: Iterable[int]) -> None:
+        nums = list(nums)
+        if nums:
+            await self._run(self._add, uid, nums)
+
+    async def clear(self, uid: int) -> None:
+        await self._run(self._clear, uid)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+def open_store(db_path: str, legacy_json: str = "") -> SavesStore:
+    """Open the store, importing legacy_json once if the database is still empty."""
+    store = SavesStore(db_path)
+    if legacy_json and os.path.isfile(legacy_json) and store.is_empty():
+        try:
+            n = store.import_json(legacy_json)
+            os.replace(legacy_json, legacy_json + ".migrated")
+            logger.info(f"Migrated {n} saved numbers from {legacy_json} to {db_path}")
+        except Exception as e:
+            logger.warning(f"Failed to migrate {legacy_json}: {e}")
+    return store
@@ -3,11 +3,22 @@ import os
 import json
 import html
 import logging
+import signal
+import codecs
+import time
+import statistics
 import subprocess
 import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import aiohttp
 
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
+
+import fragment_client
+import metrics
 
 # grab dispatcher & bot from main
 _main = sys.modules.get("__main__")
@@ -15,36 +26,110 @@ dp = getattr(_main, 'dp', None)
 
 logger = logging.getLogger(__name__)
 
-async def run_in_executor(fn, *args, **kwargs):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+# ─── /speed (single-flight, cached, with history) ─────────────────
+SPEED_TIMEOUT   = float(os.getenv("SPEED_TIMEOUT", "90"))
+SPEED_CACHE_TTL = float(os.getenv("SPEED_CACHE_TTL", "120"))  # seconds a result is served without re-running
+SPEED_HISTORY   = int(os.getenv("SPEED_HISTORY", "50"))       # runs kept for /speed history
+
+_speed_flight = fragment_client.SingleFlight()   # concurrent /speed callers share one run
+_speed_history: Deque[Dict[str, float]] = deque(maxlen=SPEED_HISTORY)
+
+async def _run_speedtest() -> Dict[str, float]:
+    proc = await asyncio.create_subprocess_exec(
+        "speedtest-cli", "--json",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        raw, _ = await asyncio.wait_for(proc.communicate(), timeout=SPEED_TIMEOUT)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    out = raw.decode("utf-8", errors="replace")
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, "speedtest-cli", output=out)
+    data = json.loads(out)
+    result = {
+        "ts": time.time(),
+        "download": data.get("download", 0) / 1_000_000,
+        "upload": data.get("upload", 0) / 1_000_000,
+        "ping": data.get("ping", 0),
+    }
+    _speed_history.append(result)
+    return result
+
+def _cached_result() -> Optional[Dict[str, float]]:
+    if _speed_history and time.time() - _speed_history[-1]["ts"] < SPEED_CACHE_TTL:
+        return _speed_history[-1]
+    return None
+
+def _format_result(r: Dict[str, float], note: str = "") -> str:
+    return (
+        "📶 <b>VPS Speed Test</b>" + (f" <i>({note})</i>" if note else "") + "\n"
+        f"• Download: <b>{r['download']:.2f} Mbps</b>\n"
+        f"• Upload:   <b>{r['upload']:.2f} Mbps</b>\n"
+        f"• Ping:     <b>{r['ping']:.2f} ms</b>"
+    )
+
+def _trend(values: List[float]) -> str:
+    """Mean of the last 3 runs against the mean of the runs before them."""
+    if len(values) < 4:
+        return ""
+    recent, older = values[-3:], values[:-3]
+    base = statistics.fmean(older)
+    if not base:
+        return ""
+    pct = (statistics.fmean(recent) - base) * 100 / base
+    arrow = "→" if abs(pct) < 5 else ("↑" if pct > 0 else "↓")
+    return f" {arrow}{pct:+.0f}%"
+
+def history_summary() -> str:
+    lines = [f"📈 <b>Speed history</b> ({len(_speed_history)} runs)"]
+    if _speed_history:
+        runs = list(_speed_history)
+        for key, unit in (("download", "Mbps"), ("upload", "Mbps"), ("ping", "ms")):
+            vals = [r[key] for r in runs]
+            lines.append(
+                f"• {key.capitalize()}: last <b>{vals[-1]:.2f}</b> · median {statistics.median(vals):.2f} · "
+                f"min {min(vals):.2f} · max {max(vals):.2f} {unit}{_trend(vals)}"
+            )
+        age = time.time() - runs[-1]["ts"]
+        lines.append(f"• Last run {age / 60:.0f} min ago")
+    if _probe_history:
+        lines.append("")
+        lines.append(f"🛰 <b>Latency probe</b> (every {PROBE_INTERVAL:g}s)")
+        for url, samples in _probe_history.items():
+            ok = [ms for _, ms in samples if ms is not None]
+            failed = len(samples) - len(ok)
+            last = samples[-1][1]
+            lines.append(
+                f"• {html.escape(url)}: last {'fail' if last is None else f'{last:.0f} ms'}"
+                + (f" · p50 {statistics.median(ok):.0f} ms · max {max(ok):.0f} ms" if ok else "")
+                + (f" · {failed}/{len(samples)} failed" if failed else "")
+                + _trend(ok)
+            )
+    return "\n".join(lines)
 
 @dp.message(Command("speed"))
 async def send_speed(message: Message):
-    status = await message.reply("⏳ Running speedtest-cli…")
+    args = (message.text or "").split()[1:]
+    mode = args[0].lower() if args else ""
+    if mode == "history":
+        return await message.reply(history_summary(), parse_mode="HTML")
+
+    cached = None if mode == "fresh" else _cached_result()
+    if cached is not None:
+        age = time.time() - cached["ts"]
+        return await message.reply(_format_result(cached, f"cached {age:.0f}s ago"), parse_mode="HTML")
+
+    joining = len(_speed_flight) > 0
+    status = await message.reply("⏳ Joining the speed test already running…" if joining else "⏳ Running speedtest-cli…")
     try:
-        # Run speedtest-cli with --json
-        raw = await asyncio.wait_for(
-            run_in_executor(
-                subprocess.check_output,
-                ["speedtest-cli", "--json"],
-                stderr=subprocess.STDOUT,
-                text=True
-            ),
-            timeout=90
-        )
-        data = json.loads(raw)
-        download = data.get("download", 0) / 1_000_000
-        upload = data.get("upload", 0) / 1_000_000
-        ping = data.get("ping", 0)
-
-        text = (
-            "📶 <b>VPS Speed Test</b>\n"
-            f"• Download: <b>{download:.2f} Mbps</b>\n"
-            f"• Upload:   <b>{upload:.2f} Mbps</b>\n"
-            f"• Ping:     <b>{ping:.2f} ms</b>"
-        )
-        await status.edit_text(text, parse_mode="HTML")
+        result = await _speed_flight.run("speedtest", _run_speedtest)
+        await status.edit_text(_format_result(result, "shared run" if joining else ""), parse_mode="HTML")
 
     except asyncio.TimeoutError:
         await status.edit_text("❌ Speed test timed out. Please try again later.")
@@ -64,9 +149,81 @@ async def send_speed(message: Message):
         logger.exception("Unexpected speedtest error")
         await status.edit_text(f"⚠️ Speed test failed: {e}")
 
+# ─── Scheduled latency probe (optional) ───────────────────────────
+PROBE_INTERVAL = float(os.getenv("SPEED_PROBE_INTERVAL", "0"))   # seconds; 0 = disabled
+PROBE_TIMEOUT  = float(os.getenv("SPEED_PROBE_TIMEOUT", "5"))
+PROBE_TARGETS  = [
+    u.strip()
+    for u in os.getenv("SPEED_PROBE_TARGETS", "https://fragment.com/,https://api.telegram.org/").split(",")
+    if u.strip()
+]
+
+_probe_history: Dict[str, Deque[Tuple[float, Optional[float]]]] = {}
+_probe_task: Optional[asyncio.Task] = None
+_PROBE_SECONDS = metrics.histogram("probe_seconds", "Latency probe round trip")
+_PROBE_FAILURES = metrics.counter("probe_failures_total", "Latency probe failures")
+
+async def probe_once(targets: List[str] = PROBE_TARGETS) -> Dict[str, Optional[float]]:
+    """One small GET per target over the shared pool; returns ms, or None on failure."""
+    session = fragment_client.get_session()
+    timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+
+    async def one(url: str) -> Optional[float]:
+        t0 = time.perf_counter()
+        try:
+            async with session.get(url, timeout=timeout, allow_redirects=False) as resp:
+                await resp.content.read(1024)
+        except Exception as e:
+            _PROBE_FAILURES.inc(target=url, error=type(e).__name__)
+            return None
+        dt = time.perf_counter() - t0
+        _PROBE_SECONDS.observe(dt, target=url)
+        return dt * 1000
+
+    results = await asyncio.gather(*(one(u) for u in targets))
+    now = time.time()
+    for url, ms in zip(targets, results):
+        _probe_history.setdefault(url, deque(maxlen=SPEED_HISTORY)).append((now, ms))
+    return dict(zip(targets, results))
+
+async def _probe_loop() -> None:
+    while True:
+        try:
+            await probe_once()
+        except Exception as e:
+            logger.warning(f"latency probe failed: {e!r}")
+        await asyncio.sleep(PROBE_INTERVAL)
+
+@dp.startup()
+async def _start_probe():
+    global _probe_task
+    if PROBE_INTERVAL > 0 and PROBE_TARGETS:
+        _probe_task = asyncio.create_task(_probe_loop())
+
+# ─── /exec (asyncio subprocess, streamed) ─────────────────────────
+EXEC_TIMEOUT       = float(os.getenv("EXEC_TIMEOUT", "120"))        # seconds before the command is killed
+EXEC_EDIT_INTERVAL = float(os.getenv("EXEC_EDIT_INTERVAL", "2.0"))  # min seconds between progress edits
+EXEC_MAX_CAPTURE   = int(os.getenv("EXEC_MAX_CAPTURE", str(20 * 1024 * 1024)))  # bytes kept for the document
+EXEC_INLINE_MAX    = 3500  # escaped chars shown in a message; leave headroom for markup
+
+_running_procs: Set[asyncio.subprocess.Process] = set()
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    """Kill the whole process group: shell=True means the command runs in a child of sh."""
+    if proc.returncode is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def _tail(text: str, limit: int = EXEC_INLINE_MAX) -> str:
+    safe = html.escape(text)
+    return safe if len(safe) <= limit else "…" + safe[-limit:]
+
 @dp.message(Command("exec"))
 async def exec_handler(message: Message):
-    """Run a shell command on the VPS and return raw output."""
+    """Run a shell command on the VPS, streaming its output into the status message."""
     status = await message.reply("⏳ Running command…")
     parts = message.text.strip().split(maxsplit=1)
     if len(parts) < 2:
@@ -76,25 +233,80 @@ async def exec_handler(message: Message):
     cmd = parts[1]
 
     try:
-        out = subprocess.check_output(
+        proc = await asyncio.create_subprocess_shell(
             cmd,
-            shell=True,
             cwd=os.getcwd(),
-            stderr=subprocess.STDOUT,
-            text=True,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,  # own process group, so _kill reaches grandchildren
         )
-    except subprocess.CalledProcessError as e:
-        out = e.output or str(e)
     except Exception as e:
-        out = f"(failed to run command: {e})"
+        return await status.edit_text(f"⚠️ Failed to run command: {html.escape(str(e))}", parse_mode="HTML")
+
+    _running_procs.add(proc)
+    captured = bytearray()
+    dropped = 0
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    shown = ""  # decoded text, only the tail matters for progress edits
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    last_edit = started
+    outcome = None
+
+    async def pump() -> None:
+        nonlocal dropped, shown, last_edit
+        while True:
+            chunk = await proc.stdout.read(65536)
+            if not chunk:
+                break
+            room = EXEC_MAX_CAPTURE - len(captured)
+            captured.extend(chunk[:room])
+            dropped += max(0, len(chunk) - room)
+            shown = (shown + decoder.decode(chunk))[-EXEC_INLINE_MAX * 2:]
+            now = loop.time()
+            if now - last_edit >= EXEC_EDIT_INTERVAL:
+                last_edit = now
+                try:
+                    await status.edit_text(
+                        f"⏳ Running… {now - started:.0f}s\n<pre>{_tail(shown)}</pre>", parse_mode="HTML"
+                    )
+                except Exception:
+                    pass  # "message is not modified" and flood limits are not worth failing over
+        await proc.wait()
 
+    try:
+        await asyncio.wait_for(pump(), timeout=EXEC_TIMEOUT)
+    except asyncio.TimeoutError:
+        _kill(proc)
+        await proc.wait()
+        outcome = f"⏱ killed after {EXEC_TIMEOUT:g}s"
+    except asyncio.CancelledError:
+        _kill(proc)
+        raise
+    finally:
+        _running_procs.discard(proc)
+
+    elapsed = loop.time() - started
+    out = captured.decode("utf-8", errors="replace")
+    header = f"📄 <b>Output</b> (exit {proc.returncode}, {elapsed:.1f}s)"
+    if outcome:
+        header += f" — {outcome}"
+    if dropped:
+        out += f"\n…({dropped} more bytes not captured)"
     if not out.strip():
         out = "(no output)"
 
-    # Telegram message length safety
     safe_out = html.escape(out)
-    MAX = 3500  # leave headroom for markup
-    if len(safe_out) > MAX:
-        safe_out = safe_out[:MAX] + "\n…(truncated)"
+    if len(safe_out) <= EXEC_INLINE_MAX:
+        return await status.edit_text(f"{header}:\n<pre>{safe_out}</pre>", parse_mode="HTML")
+
+    await status.edit_text(f"{header}: {len(captured)} bytes, sent as a file.\n<pre>{_tail(out, 800)}</pre>", parse_mode="HTML")
+    await message.reply_document(BufferedInputFile(out.encode("utf-8"), filename="exec-output.txt"))
 
-    await status.edit_text(f"📄 <b>Output:</b>\n<pre>{safe_out}</pre>", parse_mode="HTML")
+@dp.shutdown()
+async def _speed_shutdown():
+    if _probe_task is not None:
+        _probe_task.cancel()
+    for proc in list(_running_procs):
+        _kill(proc)
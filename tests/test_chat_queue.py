@@ -0,0 +1,97 @@
+# tests/test_chat_queue.py — per-chat ordering, load shedding and deadlines
+import asyncio
+
+import pytest
+
+from chat_queue import Busy, ChatQueue
+
+def test_jobs_of_one_chat_run_in_order_and_chats_interleave():
+    async def main():
+        q = ChatQueue(workers=2, max_pending=100, per_chat=10, deadline=5)
+        log = []
+
+        def job(chat, i, delay):
+            async def run():
+                log.append((chat, i, "start"))
+                await asyncio.sleep(delay)
+                log.append((chat, i, "end"))
+                return (chat, i)
+            return run
+
+        calls = [q.run(1, job(1, i, 0.02 * (3 - i))) for i in range(3)]
+        calls += [q.run(2, job(2, 0, 0.01))]
+        results = await asyncio.gather(*calls)
+        await q.stop()
+        return results, log
+
+    results, log = asyncio.run(main())
+    assert results == [(1, 0), (1, 1), (1, 2), (2, 0)]
+    chat1 = [(i, ev) for c, i, ev in log if c == 1]
+    assert chat1 == [(0, "start"), (0, "end"), (1, "start"), (1, "end"), (2, "start"), (2, "end")]
+    # chat 2 did not wait for chat 1's backlog
+    assert log.index((2, 0, "end")) < log.index((1, 0, "end"))
+
+def test_busy_chat_shares_workers_round_robin():
+    async def main():
+        q = ChatQueue(workers=1, max_pending=100, per_chat=10, deadline=5)
+        order = []
+
+        def job(chat):
+            async def run():
+                order.append(chat)
+                await asyncio.sleep(0)
+            return run
+
+        calls = [q.run(1, job(1)) for _ in range(3)] + [q.run(2, job(2)) for _ in range(2)]
+        await asyncio.gather(*calls)
+        await q.stop()
+        return order
+
+    assert asyncio.run(main()) == [1, 2, 1, 2, 1]
+
+def test_sheds_beyond_limits():
+    async def main():
+        q = ChatQueue(workers=1, max_pending=3, per_chat=2, deadline=5)
+        gate = asyncio.Event()
+
+        async def wait():
+            await gate.wait()
+
+        calls = [asyncio.ensure_future(q.run(1, wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(Busy):
+            await q.run(1, wait)            # per-chat limit
+        calls.append(asyncio.ensure_future(q.run(2, wait)))
+        await asyncio.sleep(0)
+        with pytest.raises(Busy):
+            await q.run(3, wait)            # queue-wide limit
+        gate.set()
+        await asyncio.gather(*calls)
+        stats = q.stats()
+        await q.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats["shed"] == 2 and stats["done"] == 3 and stats["pending"] == 0
+
+def test_deadline_covers_waiting_and_running():
+    async def main():
+        q = ChatQueue(workers=1, max_pending=10, per_chat=10, deadline=0.05)
+
+        async def slow():
+            await asyncio.sleep(1)
+
+        async def quick():
+            return "late"
+
+        first = asyncio.ensure_future(q.run(1, slow))      # times out while running
+        second = asyncio.ensure_future(q.run(2, quick))    # expires while waiting behind it
+        res = await asyncio.gather(first, second, return_exceptions=True)
+        stats = q.stats()
+        await q.stop()
+        return res, stats
+
+    (first, second), stats = asyncio.run(main())
+    assert isinstance(first, asyncio.TimeoutError)
+    assert isinstance(second, asyncio.TimeoutError)
+    assert stats["expired"] == 2 and stats["pending"] == 0
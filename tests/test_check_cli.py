@@ -0,0 +1,56 @@
+# tests/test_check_cli.py — checkpointed resume of the offline checker
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import check_cli  # noqa: E402
+import fragment_client  # noqa: E402
+
+class _FakeChecker:
+    fail_after = None  # blocks to finish before "crashing"
+
+    def __init__(self, **kw):
+        self.blocks = 0
+
+    async def check_many(self, block):
+        if _FakeChecker.fail_after is not None and self.blocks >= _FakeChecker.fail_after:
+            raise RuntimeError("crash")
+        self.blocks += 1
+        for num in block:
+            yield num, int(num) % 3 == 0 or (None if int(num) % 7 == 0 else False)
+
+def _run(tmp_path, *extra):
+    args = check_cli.build_parser().parse_args(
+        [str(tmp_path / "in.txt"), "-o", str(tmp_path / "out.jsonl"),
+         "--checkpoint", str(tmp_path / "run.ckpt"), "--block", "10", *extra]
+    )
+    return asyncio.run(check_cli.run(args))
+
+def test_resume_keeps_cumulative_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(fragment_client, "FragmentChecker", _FakeChecker)
+    (tmp_path / "in.txt").write_text("1000000-1000034\n")
+
+    _FakeChecker.fail_after = 2
+    with pytest.raises(RuntimeError):
+        _run(tmp_path)
+    ckpt = json.loads((tmp_path / "run.ckpt").read_text())
+    assert ckpt["consumed"] == 20 and ckpt["stats"]["checked"] == 20
+
+    _FakeChecker.fail_after = None
+    stats = _run(tmp_path)
+    rows = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+    assert len(rows) == 35
+    assert stats["checked"] == 35
+    assert stats["restricted"] == sum(1 for r in rows if r["status"] == "restricted")
+    assert stats["unknown"] == sum(1 for r in rows if r["status"] == "unknown")
+    assert json.loads((tmp_path / "run.ckpt").read_text())["stats"] == stats
+
+def test_no_resume_starts_from_zero(tmp_path, monkeypatch):
+    monkeypatch.setattr(fragment_client, "FragmentChecker", _FakeChecker)
+    (tmp_path / "in.txt").write_text("1000000-1000009\n")
+    _FakeChecker.fail_after = None
+    _run(tmp_path)
+    assert _run(tmp_path, "--no-resume")["checked"] == 10
@@ -0,0 +1,114 @@
+# tests/test_check_scheduler.py — /checkall admission: caps, round-robin, positions, cancel
+import asyncio
+
+import pytest
+
+from check_scheduler import JobScheduler, QueueFull, UserQueueFull
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+class _Jobs:
+    """Jobs that hold their slot until released by the test."""
+
+    def __init__(self, scheduler):
+        self.s = scheduler
+        self.started = []
+        self.positions = {}
+        self.gates = {}
+
+    def submit(self, uid, tag):
+        gate = self.gates[tag] = asyncio.Event()
+
+        async def on_position(pos):
+            self.positions.setdefault(tag, []).append(pos)
+
+        async def job():
+            async with self.s.slot(uid, on_position):
+                self.started.append(tag)
+                await gate.wait()
+
+        return asyncio.ensure_future(job())
+
+def test_per_user_running_cap_and_round_robin():
+    async def main():
+        s = JobScheduler(max_jobs=2, per_user=1, queue_max=10, queue_per_user=10)
+        jobs = _Jobs(s)
+        tasks = [jobs.submit("a", t) for t in ("a1", "a2", "a3")]
+        tasks += [jobs.submit("b", t) for t in ("b1", "b2")]
+        tasks.append(jobs.submit("c", "c1"))
+        await _settle()
+        assert jobs.started == ["a1", "b1"]  # a2 waits although a slot is free
+        assert s.stats()["running"] == 2 and s.stats()["queued"] == 4
+        for done in ("a1", "b1", "c1", "a2", "b2"):
+            jobs.gates[done].set()
+            await _settle()
+        jobs.gates["a3"].set()
+        await asyncio.gather(*tasks)
+        return jobs.started
+
+    assert asyncio.run(main()) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+def test_queue_positions_follow_round_robin_order():
+    async def main():
+        s = JobScheduler(max_jobs=1, per_user=1, queue_max=10, queue_per_user=10)
+        jobs = _Jobs(s)
+        tasks = [jobs.submit("x", "x0"), jobs.submit("a", "a1"), jobs.submit("a", "a2"), jobs.submit("b", "b1")]
+        await _settle()
+        first = {tag: pos[-1] for tag, pos in jobs.positions.items()}
+        jobs.gates["x0"].set()
+        await _settle()
+        for t in ("a1", "b1", "a2"):
+            jobs.gates[t].set()
+        await asyncio.gather(*tasks)
+        return first, jobs.positions
+
+    first, positions = asyncio.run(main())
+    assert first == {"a1": 1, "b1": 2, "a2": 3}
+    assert positions["b1"] == [2, 1]
+
+def test_queue_limits():
+    async def main():
+        s = JobScheduler(max_jobs=1, per_user=1, queue_max=3, queue_per_user=2)
+        jobs = _Jobs(s)
+        tasks = [jobs.submit("a", t) for t in ("a1", "a2", "a3", "a4")]
+        tasks += [jobs.submit("b", "b1"), jobs.submit("c", "c1")]
+        await _settle()
+        results = [t.exception() if t.done() else None for t in tasks]
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return results, s.stats()
+
+    results, stats = asyncio.run(main())
+    assert results[:3] == [None, None, None]
+    assert isinstance(results[3], UserQueueFull)  # a already has two waiting
+    assert results[4] is None
+    assert type(results[5]) is QueueFull          # three waiting bot-wide
+    assert stats["rejected"] == 2 and stats["running"] == 0 and stats["queued"] == 0
+
+def test_cancel_withdraws_from_queue():
+    async def main():
+        s = JobScheduler(max_jobs=1, per_user=1, queue_max=10, queue_per_user=10)
+        jobs = _Jobs(s)
+        running = jobs.submit("a", "a1")
+        waiting = jobs.submit("b", "b1")
+        behind = jobs.submit("c", "c1")
+        await _settle()
+        waiting.cancel()  # what /cancel does to a queued /checkall
+        await _settle()
+        assert s.stats()["queued"] == 1
+        assert jobs.positions["c1"][-1] == 1
+        jobs.gates["a1"].set()
+        await _settle()
+        jobs.gates["c1"].set()
+        await asyncio.gather(running, behind)
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return jobs.started, s.stats()
+
+    started, stats = asyncio.run(main())
+    assert started == ["a1", "c1"]
+    assert stats["running"] == 0 and stats["queued"] == 0
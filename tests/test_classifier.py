@@ -0,0 +1,57 @@
+# tests/test_classifier.py — streaming classifier must agree with is_restricted_html
+import asyncio
+import random
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import fragment_client  # noqa: E402
+
+class _Content:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def iter_chunked(self, _size):
+        for c in self._chunks:
+            yield c
+
+    def at_eof(self):
+        return True
+
+class _Resp:
+    charset = "utf-8"
+    content_length = None
+
+    def __init__(self, chunks):
+        self.content = _Content(chunks)
+
+def _split(data: bytes, sizes):
+    out, i = [], 0
+    for n in sizes:
+        if i >= len(data):
+            break
+        out.append(data[i:i + n])
+        i += n
+    if i < len(data):
+        out.append(data[i:])
+    return out
+
+def _classify(chunks):
+    return asyncio.run(fragment_client.classify_response(_Resp(chunks)))
+
+def test_partial_multibyte_chunk_keeps_word_boundary():
+    body = ("x" + "Blocked" + "." * 25 + "é" + "zz").encode()
+    cut = body.index("é".encode())
+    chunks = [body[:cut], body[cut:cut + 1], body[cut + 1:]]
+    assert fragment_client.is_restricted_html(body.decode()) is False
+    assert _classify(chunks) is False
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_tiny_chunks_match_full_page(seed):
+    rnd = random.Random(seed)
+    alphabet = ["x", " ", ".", "é", "ж", "🙂", "Blocked", "restricted", "<b>"]
+    text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(5, 60)))
+    data = text.encode()
+    chunks = _split(data, [rnd.randint(1, 3) for _ in range(len(data))])
+    assert _classify(chunks) == fragment_client.is_restricted_html(text)
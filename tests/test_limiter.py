@@ -0,0 +1,101 @@
+# tests/test_limiter.py — AIMD limiter decisions and fair slot sharing
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import fragment_client as fc  # noqa: E402
+
+def _feed(lim, outcomes, latency=0.05):
+    for o in outcomes:
+        lim._record(latency, o)
+
+def test_isolated_errors_do_not_back_off():
+    lim = fc.AdaptiveLimiter(initial=20, max_limit=80, window=100, error_rate=0.1, cooldown=0)
+    _feed(lim, ([fc.OK] * 49 + [fc.THROTTLED]) * 20)  # 2% errors
+    assert lim.limit == 80
+
+def test_error_burst_backs_off_once_per_window():
+    lim = fc.AdaptiveLimiter(initial=64, max_limit=64, window=100, error_rate=0.1, cooldown=0)
+    _feed(lim, [fc.THROTTLED] * 10)
+    assert lim.limit == 32
+    _feed(lim, [fc.TIMEOUT] * 9)  # the window restarted: not enough evidence yet
+    assert lim.limit == 32
+    _feed(lim, [fc.TIMEOUT])
+    assert lim.limit == 16
+
+def test_slow_start_then_additive_increase():
+    lim = fc.AdaptiveLimiter(initial=10, max_limit=1000, window=100, error_rate=0.1, cooldown=0)
+    _feed(lim, [fc.OK] * 10)
+    assert lim.limit == 20
+    _feed(lim, [fc.THROTTLED] * 10)
+    assert lim.limit == 10
+    _feed(lim, [fc.OK] * 10)
+    assert 10 < lim.limit < 11.5
+
+def _drain(q):
+    order = []
+    while True:
+        fut = q.pop()
+        if fut is None:
+            return order
+        order.append(fut.tag)
+
+def _push(q, loop, flow, tag):
+    fut = loop.create_future()
+    fut.tag = tag
+    q.push(flow, fut)
+    return fut
+
+def test_fair_queue_round_robin_and_priority():
+    loop = asyncio.new_event_loop()
+    try:
+        q = fc.FairQueue()
+        for i in range(3):
+            _push(q, loop, (fc.BULK, "alice"), f"a{i}")
+        _push(q, loop, (fc.BULK, "bob"), "b0")
+        _push(q, loop, (fc.INTERACTIVE, "carol"), "c0")
+        assert len(q) == 5
+        assert _drain(q) == ["c0", "a0", "b0", "a1", "a2"]
+    finally:
+        loop.close()
+
+def test_fair_queue_remove_and_skip_cancelled():
+    loop = asyncio.new_event_loop()
+    try:
+        q = fc.FairQueue()
+        a0 = _push(q, loop, (fc.BULK, "alice"), "a0")
+        a1 = _push(q, loop, (fc.BULK, "alice"), "a1")
+        _push(q, loop, (fc.BULK, "bob"), "b0")
+        assert q.remove((fc.BULK, "alice"), a0)
+        assert not q.remove((fc.BULK, "alice"), a0)
+        a1.cancel()
+        assert _drain(q) == ["b0"]
+        assert len(q) == 0
+    finally:
+        loop.close()
+
+def test_limiter_serves_interactive_before_bulk():
+    async def main():
+        lim = fc.AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+        order = []
+        gate = asyncio.Event()
+
+        async def fetch(prio, owner):
+            fc.set_flow(prio, owner)
+            async with lim.slot():
+                order.append(owner)
+                await gate.wait()
+
+        first = asyncio.create_task(fetch(fc.BULK, "holder"))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(fetch(fc.BULK, "bulk")) for _ in range(3)]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(fetch(fc.INTERACTIVE, "inline")))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *waiters)
+        return order
+
+    assert asyncio.run(main()) == ["holder", "inline", "bulk", "bulk", "bulk"]
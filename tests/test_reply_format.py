@@ -0,0 +1,65 @@
+# tests/test_reply_format.py — reply normalization and Telegram-safe splitting
+import html
+import random
+import re
+
+import pytest
+
+from reply_format import format_reply, normalize, split_html
+
+def _normalize_old(text):
+    """The line-by-line implementation normalize() replaced; outputs must stay identical."""
+    out = []
+    for ln in (text or "").splitlines():
+        s = ln.strip()
+        if s.startswith("##"):
+            s = "• " + s.lstrip("#").strip()
+        elif s.startswith("* ") or s.startswith("- "):
+            s = "• " + s[2:].strip()
+        out.append(s)
+    return "\n".join(out).strip()
+
+@pytest.mark.parametrize("text, expected", [
+    ("## Title\n- one\n*  two\n  plain  ", "• Title\n• one\n• two\nplain"),
+    ("-\ta", "-\ta"),
+    ("-\u3000a", "-\u3000a"),
+    ("*bold*", "*bold*"),
+    ("a\r\nb\u2028c", "a\nb\nc"),
+])
+def test_normalize_cases(text, expected):
+    assert normalize(text) == expected == _normalize_old(text)
+
+def test_normalize_matches_old_implementation():
+    alphabet = ["-", "*", "#", "##", " ", "\t", "\u3000", "\xa0", "\n", "\r\n", "\r",
+                "\x1c", "\x1f", "\x85", "\u2028", "\v", "\f", "a", "b"]
+    rnd = random.Random(0)
+    for _ in range(20000):
+        text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12)))
+        assert normalize(text) == _normalize_old(text), repr(text)
+
+def test_format_reply_limits_emojis():
+    assert format_reply("hi 😀😀😀 there 🎉", allow_emojis=True) == "hi 😀😀 there"
+    assert format_reply("hi 😀", allow_emojis=False) == "hi"
+
+_PARTIAL_ENTITY_RE = re.compile(r"&[#a-z0-9]*$")
+
+@pytest.mark.parametrize("seed", range(10))
+def test_split_html_respects_limit_and_entities(seed):
+    rnd = random.Random(seed)
+    words = ["<b>", "&", "a&amp;b", '"q"', "'", "word", "longerword", "\n", "\n\n", "x" * 50]
+    text = " ".join(rnd.choice(words) for _ in range(rnd.randint(200, 2000)))
+    limit = rnd.choice([50, 100, 4096])
+    chunks = split_html(text, limit)
+    assert chunks
+    for c in chunks:
+        assert 0 < len(c) <= limit
+        assert "<" not in c and ">" not in c      # every tag-like character is escaped
+        assert not _PARTIAL_ENTITY_RE.search(c)   # no entity cut at the end…
+        assert html.escape(html.unescape(c)) == c  # …or at the start
+    joined = re.sub(r"\s+", "", "".join(html.unescape(c) for c in chunks))
+    assert joined == re.sub(r"\s+", "", text)
+
+def test_split_html_short_and_empty():
+    assert split_html("a < b") == ["a &lt; b"]
+    assert split_html("") == []
+    assert split_html("&" * 10, limit=10) == ["&amp;&amp;", "&amp;&amp;", "&amp;&amp;", "&amp;&amp;", "&amp;&amp;"]
@@ -0,0 +1,28 @@
+# tests/test_saves_store.py — range parsing shared by /save and check_cli
+import pytest
+
+from saves_store import NumberSet, RangeError, parse_range
+
+@pytest.mark.parametrize("tok, expected", [
+    ("888000100-888000999", (888000100, 888000999)),
+    ("+888000100-+888000999", (888000100, 888000999)),
+    ("888000100-999", (888000100, 888000999)),
+    ("888000100-888000100", (888000100, 888000100)),
+])
+def test_ranges(tok, expected):
+    assert parse_range(tok) == expected
+
+@pytest.mark.parametrize("tok", ["+888-01234567", "0123-4567", "888000100-8880001000", "88800010", "a-b"])
+def test_dashed_numbers_are_not_ranges(tok):
+    assert parse_range(tok) is None
+
+@pytest.mark.parametrize("tok", ["888000999-888000100", "888000999-100", "1" * 19 + "-2"])
+def test_invalid_ranges_raise(tok):
+    with pytest.raises(RangeError):
+        parse_range(tok)
+
+def test_count_range():
+    s = NumberSet([5, 10, 11, 20])
+    assert s.count_range(10, 20) == 3
+    assert s.count_range(12, 19) == 0
+    assert s.add_range(8, 12, limit=100) == [8, 9, 12]